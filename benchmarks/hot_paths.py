@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""CPU and memory regression benchmark of sabacan client-side hot paths.
+
+This script runs offline benchmarks of PlantUML text encoding, pipe
+reading, counting and merging RedPen results, and file walking. It
+reports the median and minimum times and the peak allocation of each
+benchmark, and compares the minimum time and the peak allocation
+against a baseline.
+
+Baselines depend on the machine, so that no baseline is committed.
+Save a baseline on your machine before a change (``make bench-save``),
+and compare with it after the change (``make bench``). Times are
+normalized by a fixed calibration loop measured just before each
+benchmark, so that changes of CPU frequency and load affect the ratios
+less.
+
+Usage::
+
+    python benchmarks/hot_paths.py [--save] [--baseline FILE] [--filter TEXT]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+_BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _BASEDIR)
+
+import sabacan.plantuml # pylint: disable=wrong-import-position
+import sabacan.redpen # pylint: disable=wrong-import-position
+
+_DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'hot_paths_baseline.json')
+
+_UML_SIZES = [('1k', 1 << 10), ('64k', 1 << 16), ('512k', 1 << 19)]
+_COMPRESS_LEVELS = [1, 6, 9]
+_NUM_ERRORS = 10000
+_NUM_DOCUMENTS = 100
+_NUM_ERRORS_PER_DOCUMENT = 200
+_TREE_SHAPE = (10, 10, 20) # directories, subdirectories, files
+_MIN_RUN_TIME = 0.02
+_CALIBRATION_DATA = bytes(range(256)) * 64
+
+
+def _make_uml_code(size):
+    rand = random.Random(size)
+    lines = ['@startuml']
+    length = len(lines[0])
+    while length < size:
+        line = 'Actor%d -> Actor%d : message %d' % (
+            rand.randrange(50), rand.randrange(50), rand.randrange(1000))
+        lines.append(line)
+        length += len(line) + 1
+    lines.append('@enduml')
+    return '\n'.join(lines)
+
+
+def _make_error(line_num):
+    return {
+        'sentence': 'This is sentence %d.' % line_num,
+        'message': 'Found invalid word in sentence %d' % line_num,
+        'validator': 'InvalidWord',
+        'lineNum': line_num,
+        'sentenceStartColumnNum': 0,
+        'startPosition': {'lineNum': line_num, 'offset': 5},
+        'endPosition': {'lineNum': line_num, 'offset': 7},
+    }
+
+
+def _make_result(output_format, num_errors):
+    errors = [_make_error(i + 1) for i in range(num_errors)]
+    if output_format == 'json':
+        return json.dumps({'document': '', 'errors': errors})
+    if output_format == 'json2':
+        return json.dumps({'document': '', 'errors': [
+            {'sentence': error['sentence'],
+             'position': {'start': error['startPosition'],
+                          'end': error['endPosition']},
+             'errors': [{'message': error['message'],
+                         'validator': error['validator']}]}
+            for error in errors]})
+    if output_format == 'plain':
+        return '\n'.join(
+            '%d: ValidationError[%s], %s at line: %s' % (
+                error['lineNum'], error['validator'], error['message'],
+                error['sentence'])
+            for error in errors)
+    if output_format == 'plain2':
+        return ''.join(
+            '\nLine: %d, Offset: 5\n    Sentence: %s\n    %s\n' % (
+                error['lineNum'], error['sentence'], error['message'])
+            for error in errors)
+    return '<validation-result>%s</validation-result>' % ''.join(
+        '<error validator="%s"><message>%s</message><sentence>%s</sentence>'
+        '<lineNum>%d</lineNum><sentenceStartColumnNum>0'
+        '</sentenceStartColumnNum></error>' % (
+            error['validator'], error['message'], error['sentence'],
+            error['lineNum'])
+        for error in errors)
+
+
+def _make_tree(basedir):
+    num_dirs, num_subdirs, num_files = _TREE_SHAPE
+    for i in range(num_dirs):
+        for j in range(num_subdirs):
+            dirpath = os.path.join(basedir, 'd%d' % i, 's%d' % j)
+            os.makedirs(dirpath)
+            for k in range(num_files):
+                suffix = '.puml' if k % 2 == 0 else '.txt'
+                with open(os.path.join(dirpath, 'f%d%s' % (k, suffix)),
+                          'w') as source:
+                    source.write('@startuml\nA -> B\n@enduml\n')
+
+
+def _make_benchmarks(tmpdir):
+    benchmarks = []
+    for size_name, size in _UML_SIZES:
+        uml_code = _make_uml_code(size)
+        for level in _COMPRESS_LEVELS:
+            benchmarks.append((
+                'encode_code/%s/level%d' % (size_name, level),
+                lambda uml_code=uml_code, level=level:
+                sabacan.plantuml.encode_code(uml_code, level)))
+        encoded = sabacan.plantuml.encode_code(uml_code)
+        benchmarks.append((
+            'decode_code/%s' % size_name,
+            lambda encoded=encoded: sabacan.plantuml.decode_code(encoded)))
+
+    stream_text = '\n'.join([_make_uml_code(1 << 12)] * 256) + '\n'
+    def read_pipe():
+        stdin = io.StringIO(stream_text)
+        # pylint: disable=protected-access
+        while sabacan.plantuml._read_uml_code(stdin):
+            pass
+    benchmarks.append(('_read_uml_code/1M', read_pipe))
+
+    for output_format in sabacan.redpen._FORMAT_LIST: # pylint: disable=protected-access
+        result = _make_result(output_format, _NUM_ERRORS)
+        benchmarks.append((
+            'get_number_of_errors/%s' % output_format,
+            lambda result=result, output_format=output_format:
+            sabacan.redpen.get_number_of_errors(result, output_format)))
+
+    for output_format in sabacan.redpen._FORMAT_LIST: # pylint: disable=protected-access
+        result = _make_result(output_format, _NUM_ERRORS_PER_DOCUMENT)
+        results = [('doc%d.md' % i, result) for i in range(_NUM_DOCUMENTS)]
+        benchmarks.append((
+            '_merge_result/%s' % output_format,
+            lambda results=results, output_format=output_format:
+            sabacan.redpen._merge_result(results, output_format))) # pylint: disable=protected-access
+
+    treedir = os.path.join(tmpdir, 'tree')
+    _make_tree(treedir)
+    pattern = os.path.join(treedir, '**', '*.puml')
+    for jobs in (1, 4):
+        benchmarks.append((
+            '_for_each_file/jobs%d' % jobs,
+            lambda jobs=jobs: sabacan.plantuml._for_each_file( # pylint: disable=protected-access
+                [pattern], lambda path: True, jobs=jobs)))
+    return benchmarks
+
+
+def _measure(func, repeat):
+    # Short benchmarks are looped so that each run takes _MIN_RUN_TIME
+    start = time.perf_counter()
+    func()
+    number = max(1, int(_MIN_RUN_TIME / (time.perf_counter() - start)))
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'time': statistics.median(times), 'min': min(times), 'peak': peak}
+
+
+def _calibration_loop():
+    total = 0
+    for i in range(10000):
+        total += i % 7
+    zlib.compress(_CALIBRATION_DATA, 6)
+    return total
+
+
+def _compare(name, measurement, baseline, args):
+    base = baseline.get(name)
+    if base is None:
+        return True, ''
+    # Minimum time is less affected by other processes than median
+    time_ratio = ((measurement['min'] / measurement['calibration'])
+                  / (base['min'] / base['calibration']))
+    peak_ratio = measurement['peak'] / max(base['peak'], 1)
+    result = True
+    notes = ['time x%.2f' % time_ratio, 'peak x%.2f' % peak_ratio]
+    if time_ratio > args.time_threshold:
+        notes.append('REGRESSION: time')
+        result = False
+    if peak_ratio > args.memory_threshold:
+        notes.append('REGRESSION: peak')
+        result = False
+    return result, ', '.join(notes)
+
+
+def main():
+    """Run benchmarks and exit with non-zero on regression."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=7,
+                        help='number of timed runs (default: %(default)d)')
+    parser.add_argument('--filter', default='',
+                        help='run only benchmarks whose name includes TEXT',
+                        metavar='TEXT')
+    parser.add_argument('--baseline', default=_DEFAULT_BASELINE,
+                        help='baseline file (default: %(default)s)',
+                        metavar='FILE')
+    parser.add_argument('--save', action='store_true',
+                        help='save the results as the baseline')
+    parser.add_argument('--time-threshold', type=float, default=1.5,
+                        help='maximum ratio of normalized minimum time to '
+                             'the baseline (default: %(default).1f)')
+    parser.add_argument('--memory-threshold', type=float, default=1.2,
+                        help='maximum ratio of peak allocation to '
+                             'the baseline (default: %(default).1f)')
+    args = parser.parse_args()
+
+    baseline = None
+    if not args.save:
+        if not os.path.exists(args.baseline):
+            print('No baseline in %s. Run with --save on this machine first.'
+                  % args.baseline, file=sys.stderr)
+            sys.exit(2)
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    measurements = {}
+    result = True
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, func in _make_benchmarks(tmpdir):
+            if args.filter not in name:
+                continue
+            calibration = _measure(_calibration_loop, args.repeat)['min']
+            measurement = measurements[name] = _measure(func, args.repeat)
+            measurement['calibration'] = calibration
+            passed, notes = True, ''
+            if baseline is not None:
+                passed, notes = _compare(name, measurement, baseline, args)
+            result = result and passed
+            print('%-32s median %9.3f msec (min %9.3f msec) peak %9.1f KiB'
+                  '  %s' % (name, measurement['time'] * 1000,
+                            measurement['min'] * 1000,
+                            measurement['peak'] / 1024, notes))
+
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as baseline_file:
+            json.dump(measurements, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+    sys.exit(0 if result else 1)
+
+
+if __name__ == '__main__':
+    main()
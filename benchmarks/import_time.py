@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Import time regression benchmark of sabacan command startup.
+
+This script measures the time to import sabacan and to make the parser
+of each subcommand in fresh interpreters, and checks that the startup
+does not import modules unused by the selected subcommand.
+
+Usage::
+
+    python benchmarks/import_time.py [--runs N] [--threshold MSEC]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+_BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import sabacan
+sabacan.make_subcommand_parser('sabacan', %r)
+elapsed = time.perf_counter() - start
+modules = sorted(sys.modules)
+import json
+print(json.dumps({'elapsed': elapsed, 'modules': modules}))
+'''
+
+# Modules which must not be imported only by making the subcommand parser
+_FORBIDDEN_MODULE_TABLE = {
+    'plantuml': ['sabacan.redpen', 'lxml', 'xml.etree', 'concurrent'],
+    'redpen': [
+        'sabacan.plantuml', 'sabacan.archive', 'sabacan.embedded',
+        'lxml', 'xml.etree', 'concurrent',
+    ],
+}
+
+
+def _measure(subcommand):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [_BASEDIR, env.get('PYTHONPATH')]))
+    output = subprocess.check_output(
+        [sys.executable, '-c', _SCRIPT % subcommand], env=env)
+    return json.loads(output.decode('utf-8'))
+
+
+def main():
+    """Run benchmark and exit with non-zero on regression."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10,
+                        help='number of runs (default: %(default)d)')
+    parser.add_argument('--threshold', type=float, default=150.0,
+                        help='maximum median time in msec '
+                             '(default: %(default).0f)')
+    args = parser.parse_args()
+
+    result = True
+    for subcommand, forbidden_modules in sorted(
+            _FORBIDDEN_MODULE_TABLE.items()):
+        measurements = [_measure(subcommand) for _ in range(args.runs)]
+        median = statistics.median(
+            m['elapsed'] for m in measurements) * 1000
+        print('%-10s median %7.2f msec (min %7.2f msec)' % (
+            subcommand, median,
+            min(m['elapsed'] for m in measurements) * 1000))
+        if median > args.threshold:
+            print('  REGRESSION: exceeds %.0f msec' % args.threshold)
+            result = False
+        modules = measurements[0]['modules']
+        for forbidden in forbidden_modules:
+            loaded = [module for module in modules
+                      if module == forbidden
+                      or module.startswith(forbidden + '.')]
+            if loaded:
+                print('  REGRESSION: imports %s' % ', '.join(loaded))
+                result = False
+    sys.exit(0 if result else 1)
+
+
+if __name__ == '__main__':
+    main()
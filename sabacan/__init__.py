@@ -6,18 +6,53 @@ This module may use the following environment variables.
     URL of server.
 :SABACAN_TIMEOUT:
     Timeout (sec) of server communication.
+:SABACAN_HEDGE_PERCENTILE:
+    Percentile of recent latencies after which a duplicate request is sent.
+:SABACAN_HEDGE_URL:
+    Comma separated URLs of servers which duplicate requests are sent to.
+:SABACAN_HEDGE_BUDGET:
+    Maximum ratio of duplicate requests to requests.
 """
 import argparse
-import sabacan.plantuml
-import sabacan.redpen
+import importlib
+
+import sabacan.tracing
 from sabacan.utils import SetEnvAction, SetFlagEnvAction
 
 
 __version__ = '0.0.4'
 
+# Subcommand modules are imported only when the subcommand is selected,
+# so that the startup does not pay for unused modules and parsers.
+_SUBCOMMAND_MODULE_TABLE = {
+    'plantuml': 'sabacan.plantuml',
+    'redpen': 'sabacan.redpen',
+    'redpen-lsp': 'sabacan.lsp',
+    'serve': 'sabacan.daemon',
+}
+
+
+def make_subcommand_parser(prog, subcommand):
+    """Import the subcommand module and make its parser.
+
+    Args:
+        prog (str): The program name of the parent command.
+        subcommand (str): The subcommand name.
+    Returns:
+        argparse.ArgumentParser: The parser of the subcommand.
+    """
+    module = importlib.import_module(_SUBCOMMAND_MODULE_TABLE[subcommand])
+    return module.make_parser(
+        lambda name, **kwargs: argparse.ArgumentParser(
+            '%s %s' % (prog, name), **kwargs))
+
 
-def main():
+def main(argv=None):
     """Run sabacan command.
+
+    Args:
+        argv (list): Command line arguments without program name.
+            Defaults to sys.argv[1:].
     """
     parser = argparse.ArgumentParser('sabacan')
     parser.add_argument(
@@ -49,16 +84,65 @@ def main():
         action=SetFlagEnvAction,
         dest='_SABACAN_INSECURE',
         default='0')
+    parser.add_argument(
+        '--adaptive',
+        help=('Adapt the number of concurrent requests and timeouts '
+              'to server latency'),
+        action=SetFlagEnvAction,
+        dest='_SABACAN_ADAPTIVE',
+        default='0')
+    parser.add_argument(
+        '--hedge',
+        help=('Send a duplicate request if a request takes longer than '
+              'P percentile of recent latencies'),
+        metavar='P',
+        type=float,
+        action=SetEnvAction,
+        dest='SABACAN_HEDGE_PERCENTILE')
+    parser.add_argument(
+        '--hedge-url',
+        help='Comma separated server URLs for duplicate requests',
+        metavar='URL',
+        action=SetEnvAction,
+        dest='SABACAN_HEDGE_URL')
+    parser.add_argument(
+        '--hedge-budget',
+        help='Maximum ratio of duplicate requests (default: 0.05)',
+        metavar='RATIO',
+        type=float,
+        action=SetEnvAction,
+        dest='SABACAN_HEDGE_BUDGET')
 
-    subparsers = parser.add_subparsers(
-        title='supported subcommand',
+    parser.add_argument(
+        '--trace',
+        help=('Record durations of processing phases into the file '
+              'in Chrome trace event format'),
+        metavar='FILE')
+
+    subcommand_group = parser.add_argument_group('supported subcommand')
+    subcommand_group.add_argument(
+        'subcommand',
         help='%(choices)s',
+        nargs='?',
+        choices=list(_SUBCOMMAND_MODULE_TABLE),
         metavar='subcommand')
-    sabacan.plantuml.make_parser(subparsers.add_parser)
-    sabacan.redpen.make_parser(subparsers.add_parser)
+    subcommand_group.add_argument(
+        'subcommand_args',
+        help=argparse.SUPPRESS,
+        nargs=argparse.REMAINDER)
 
-    args = parser.parse_args()
-    if hasattr(args, 'main_function'):
-        args.main_function(args)
-    else:
+    args = parser.parse_args(argv)
+    if args.subcommand is None:
         parser.print_help()
+        return
+    trace_path = args.trace
+    subparser = make_subcommand_parser(parser.prog, args.subcommand)
+    args = subparser.parse_args(args.subcommand_args)
+    if trace_path is None:
+        args.main_function(args)
+        return
+    sabacan.tracing.start()
+    try:
+        args.main_function(args)
+    finally:
+        sabacan.tracing.stop(trace_path)
@@ -0,0 +1,196 @@
+"""This module provides functions to read and write zip/tar archives.
+
+Archive members are read into memory, so that they can be processed
+without being extracted to disk.
+"""
+import io
+import logging
+import pathlib
+import posixpath
+import tarfile
+import threading
+import time
+import zipfile
+
+_ZIP_SUFFIXES = ('.zip',)
+_TAR_SUFFIXES = {
+    '.tar': '',
+    '.tar.gz': 'gz',
+    '.tgz': 'gz',
+    '.tar.bz2': 'bz2',
+    '.tbz2': 'bz2',
+    '.tar.xz': 'xz',
+    '.txz': 'xz',
+}
+
+
+def _get_tar_compression(path):
+    name = pathlib.PurePath(path).name.lower()
+    for suffix, compression in _TAR_SUFFIXES.items():
+        if name.endswith(suffix):
+            return compression
+    return None
+
+
+def is_archive(path):
+    """Check whether the path is an archive supported by this module.
+
+    The check depends only on the file name.
+
+    Args:
+        path (str or pathlib.PurePath): The path to check.
+    Returns:
+        bool: True if the path has a zip or tar suffix.
+    """
+    name = pathlib.PurePath(path).name.lower()
+    if name.endswith(_ZIP_SUFFIXES):
+        return True
+    return _get_tar_compression(path) is not None
+
+
+def normalize_member_name(name):
+    """Normalize the path of an archive member.
+
+    Args:
+        name (str or pathlib.PurePath): The member path.
+    Returns:
+        str: The normalized POSIX path. None if the path is absolute or
+            goes up out of the archive root, since such a member may be
+            written outside the output directory.
+    """
+    name = str(name).replace('\\', '/')
+    path = posixpath.normpath(name)
+    if (path.startswith('/') or path == '..' or path.startswith('../')
+            or pathlib.PureWindowsPath(path).drive):
+        return None
+    return path
+
+
+class ArchiveMember:
+    """Regular file in an archive.
+
+    Attributes:
+        archive (pathlib.Path): The path to the archive.
+        path (pathlib.PurePosixPath): The path of the member in the archive.
+    """
+    def __init__(self, archive, path, data):
+        self.archive = archive
+        self.path = pathlib.PurePosixPath(path)
+        self._data = data
+
+    @property
+    def name(self):
+        """Get the final component of the member path"""
+        return self.path.name
+
+    def read_bytes(self):
+        """Get the contents of the member"""
+        return self._data
+
+    def read_text(self, encoding=None):
+        """Get the contents of the member as text"""
+        return self._data.decode(encoding or 'utf-8')
+
+    def __str__(self):
+        return '%s:%s' % (self.archive, self.path)
+
+
+def iter_members(archive, suffixes=None, failures=None):
+    """Iterate regular files in the archive.
+
+    Members are read one by one, so that the whole archive is
+    not loaded into memory. Members whose paths are absolute or go up
+    out of the archive root are skipped with an error log.
+
+    Args:
+        archive (pathlib.Path): The path to zip or tar archive.
+        suffixes (iterable): If given, only members which have one of
+            the suffixes are yielded.
+        failures (list): If given, the skipped members are appended as
+            strings.
+    Yields:
+        ArchiveMember: The regular file in the archive.
+    """
+    if suffixes is not None:
+        suffixes = tuple(suffixes)
+    def accept(name):
+        if suffixes is not None and not name.lower().endswith(suffixes):
+            return False
+        if normalize_member_name(name) is None:
+            logging.error('%s:%s: Unsafe member path', archive, name)
+            if failures is not None:
+                failures.append('%s:%s' % (archive, name))
+            return False
+        return True
+
+    if _get_tar_compression(archive) is not None:
+        with tarfile.open(str(archive), 'r|*') as tar:
+            for info in tar:
+                if not info.isfile() or not accept(info.name):
+                    continue
+                with tar.extractfile(info) as member:
+                    data = member.read()
+                yield ArchiveMember(
+                    archive, normalize_member_name(info.name), data)
+        return
+    with zipfile.ZipFile(str(archive)) as zfile:
+        for info in zfile.infolist():
+            if info.filename.endswith('/') or not accept(info.filename):
+                continue
+            yield ArchiveMember(archive, normalize_member_name(info.filename),
+                                zfile.read(info))
+
+
+class ArchiveWriter:
+    """Writer which adds files to zip or tar archive.
+
+    Writes from multiple threads are serialized, so that an instance
+    can be shared by workers.
+    """
+    def __init__(self, archive):
+        self._lock = threading.Lock()
+        compression = _get_tar_compression(archive)
+        if compression is not None:
+            self._tar = tarfile.open(str(archive), 'w:' + compression)
+            self._zip = None
+        else:
+            self._tar = None
+            self._zip = zipfile.ZipFile(
+                str(archive), 'w', compression=zipfile.ZIP_DEFLATED)
+
+    def write(self, name, data):
+        """Add data to the archive as a regular file.
+
+        Args:
+            name (str or pathlib.PurePath): The member path in the archive.
+            data (bytes): The contents of the member.
+        Raises:
+            ValueError: If the name is absolute or goes up out of
+                the archive root.
+        """
+        path = normalize_member_name(pathlib.PurePath(name).as_posix())
+        if path is None:
+            raise ValueError('Unsafe member path: %s' % name)
+        name = path
+        with self._lock:
+            if self._zip is not None:
+                self._zip.writestr(name, data)
+                return
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = time.time()
+            self._tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        """Finish writing the archive"""
+        with self._lock:
+            if self._zip is not None:
+                self._zip.close()
+            else:
+                self._tar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
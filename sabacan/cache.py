@@ -0,0 +1,75 @@
+"""This module provides a file based cache of validation results.
+
+Each entry is stored in a file named by the hex digest of its key,
+so that entries can be shared by concurrent processes.
+"""
+import hashlib
+import os
+import pathlib
+import tempfile
+
+
+def make_key(*parts):
+    """Make a cache key from strings.
+
+    Args:
+        parts (str): Strings which identify the entry. None is allowed.
+    Returns:
+        str: The hex digest of the parts.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            digest.update(b'-:')
+            continue
+        data = part.encode('utf8')
+        # Length prefix keeps boundaries between parts unambiguous
+        digest.update(b'%d:' % len(data))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Directory of cached results.
+
+    Args:
+        directory (str or pathlib.Path): The cache directory.
+            It is created if it does not exist.
+    """
+    def __init__(self, directory):
+        self._directory = pathlib.Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+    def _get_path(self, key):
+        return self._directory / key[:2] / key[2:]
+
+    def get(self, key):
+        """Get the cached text.
+
+        Args:
+            key (str): The key made by `make_key`.
+        Returns:
+            str: The cached text. If not cached, return None.
+        """
+        try:
+            return self._get_path(key).read_text(encoding='utf8')
+        except OSError:
+            return None
+
+    def put(self, key, text):
+        """Store the text.
+
+        Args:
+            key (str): The key made by `make_key`.
+            text (str): The text to be cached.
+        """
+        path = self._get_path(key)
+        path.parent.mkdir(exist_ok=True)
+        fd, tmppath = tempfile.mkstemp(dir=str(path.parent))
+        try:
+            with os.fdopen(fd, 'w', encoding='utf8') as tmpfile:
+                tmpfile.write(text)
+            os.replace(tmppath, str(path))
+        except OSError:
+            os.unlink(tmppath)
+            raise
@@ -0,0 +1,153 @@
+"""This module provides functions to split documents along structural
+boundaries (headings, sections and blank-line separated paragraphs).
+
+Documents are split only at the beginning of lines, so that line numbers
+in a unit can be mapped to the whole document by adding the line offset
+of the unit.
+"""
+import re
+
+_MARKDOWN_HEADING_PATTERN = re.compile(r'^#{1,6}(\s|$)')
+_MARKDOWN_FENCE_PATTERN = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+_ASCIIDOC_HEADING_PATTERN = re.compile(r'^={1,6}\s')
+_ASCIIDOC_DELIMITER_PATTERN = re.compile(r'^(-{4,}|\.{4,}|={4,}|\+{4,})\s*$')
+_LATEX_SECTION_PATTERN = re.compile(r'^\\(part|chapter|(sub)*section)\b')
+_WIKI_HEADING_PATTERN = re.compile(r'^h[1-6]\.\s')
+_REVIEW_HEADING_PATTERN = re.compile(r'^={1,5}[\s\[{]')
+_REVIEW_BLOCK_BEGIN_PATTERN = re.compile(r'^//\w+.*\{\s*$')
+_REVIEW_BLOCK_END_PATTERN = re.compile(r'^//\}\s*$')
+
+_HEADING_PATTERN_TABLE = {
+    'markdown': _MARKDOWN_HEADING_PATTERN,
+    'asciidoc': _ASCIIDOC_HEADING_PATTERN,
+    'latex': _LATEX_SECTION_PATTERN,
+    'wiki': _WIKI_HEADING_PATTERN,
+    'review': _REVIEW_HEADING_PATTERN,
+}
+
+
+class Unit:
+    """Part of a document.
+
+    Attributes:
+        line_offset (int): The number of lines before the unit.
+        text (str): The text of the unit.
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('line_offset', 'text')
+
+    def __init__(self, line_offset, text):
+        self.line_offset = line_offset
+        self.text = text
+
+    @property
+    def num_lines(self):
+        """Get the number of lines in the unit"""
+        return len(self.text.splitlines())
+
+
+def _is_block_delimiter(line, document_parser, in_block):
+    if document_parser == 'markdown':
+        return _MARKDOWN_FENCE_PATTERN.match(line) is not None
+    if document_parser == 'asciidoc':
+        return _ASCIIDOC_DELIMITER_PATTERN.match(line) is not None
+    if document_parser == 'review':
+        pattern = (_REVIEW_BLOCK_END_PATTERN if in_block
+                   else _REVIEW_BLOCK_BEGIN_PATTERN)
+        return pattern.match(line) is not None
+    return False
+
+def _is_properties_boundary(lines, index):
+    previous = lines[index - 1].rstrip('\r\n')
+    return (not previous.endswith('\\')
+            and not lines[index][0].isspace())
+
+def iter_boundaries(lines, document_parser):
+    """Iterate indices of lines where a structural unit can begin.
+
+    A unit begins at a heading or at the first line of a paragraph
+    after blank lines. Lines in code blocks and indented lines
+    (e.g. reST literal blocks and directive contents) are never boundaries.
+    Each property of properties documents begins a unit.
+
+    Args:
+        lines (list): The lines of document.
+        document_parser (str): Document format.
+    Yields:
+        int: The index of line.
+    """
+    heading_pattern = _HEADING_PATTERN_TABLE.get(document_parser)
+    in_block = False
+    after_blank = False
+    for index, line in enumerate(lines):
+        if _is_block_delimiter(line, document_parser, in_block):
+            if not in_block and (after_blank or index == 0):
+                yield index
+            in_block = not in_block
+            after_blank = False
+            continue
+        if in_block:
+            continue
+        if not line.strip():
+            after_blank = True
+            continue
+        is_indented = line[0].isspace()
+        is_heading = (heading_pattern is not None
+                      and heading_pattern.match(line) is not None)
+        if document_parser == 'properties' and index > 0:
+            is_heading = _is_properties_boundary(lines, index)
+        if index > 0 and (is_heading or (after_blank and not is_indented)):
+            yield index
+        after_blank = False
+
+
+def split_units(document, document_parser):
+    """Split the document into structural units.
+
+    Args:
+        document (str): The document.
+        document_parser (str): Document format.
+    Returns:
+        list: The list of Unit. Joining their texts gives the document.
+    """
+    lines = document.splitlines(True)
+    units = []
+    start = 0
+    for boundary in iter_boundaries(lines, document_parser):
+        if boundary > start:
+            units.append(Unit(start, ''.join(lines[start:boundary])))
+            start = boundary
+    if start < len(lines) or not units:
+        units.append(Unit(start, ''.join(lines[start:])))
+    return units
+
+
+def split_document(document, document_parser, chunk_size):
+    """Split the document into chunks along structural boundaries.
+
+    Consecutive units are packed into a chunk until its size reaches
+    chunk_size. A unit larger than chunk_size becomes a chunk by itself.
+
+    Args:
+        document (str): The document.
+        document_parser (str): Document format.
+        chunk_size (int): The threshold of chunk size in characters.
+    Returns:
+        list: The list of Unit.
+    """
+    if len(document) <= chunk_size:
+        return [Unit(0, document)]
+    chunks = []
+    pending = []
+    pending_size = 0
+    for unit in split_units(document, document_parser):
+        if pending and pending_size + len(unit.text) > chunk_size:
+            chunks.append(Unit(pending[0].line_offset,
+                               ''.join(u.text for u in pending)))
+            pending = []
+            pending_size = 0
+        pending.append(unit)
+        pending_size += len(unit.text)
+    chunks.append(Unit(pending[0].line_offset,
+                       ''.join(u.text for u in pending)))
+    return chunks
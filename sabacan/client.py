@@ -0,0 +1,188 @@
+"""This module provides the thin client of sabacan daemon.
+
+The client forwards command line arguments, current directory and
+sabacan environment variables to the daemon started by `sabacan serve`,
+and writes back standard output, standard error and exit code.
+Standard input is read only when the command requests it, so that
+the input is not consumed by commands which do not read it. If the daemon is not running, the command is executed in
+the client process.
+
+This module may use the following environment variables.
+
+:SABACAN_SOCKET:
+    Path of Unix domain socket of sabacan daemon.
+"""
+import json
+import os
+import socket
+import struct
+import queue
+import sys
+import tempfile
+import threading
+
+import sabacan
+
+# Frame channels
+ARGS = b'A'
+STDIN = b'I'
+STDIN_REQUEST = b'R'
+STDOUT = b'O'
+STDERR = b'E'
+EXIT = b'X'
+
+_HEADER = struct.Struct('!cI')
+_FORWARDED_ENV_PREFIXES = ('SABACAN_', '_SABACAN_', 'REDPEN_')
+
+
+def get_socket_path():
+    """Get the path of Unix domain socket of sabacan daemon.
+
+    Returns:
+        str: The path of the socket.
+    """
+    path = os.getenv('SABACAN_SOCKET')
+    if path is not None:
+        return path
+    rundir = os.getenv('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(rundir, 'sabacan-%d.sock' % os.getuid())
+
+
+def _is_owned_by_user(sock, path):
+    """Check that the daemon is run by the current user.
+
+    The default socket path may be in a shared temporary directory,
+    where another user can create the socket first.
+    """
+    uid = os.getuid()
+    if getattr(socket, 'SO_PEERCRED', None) is not None:
+        credentials = sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        _, peer_uid, _ = struct.unpack('3i', credentials)
+        return peer_uid == uid
+    return os.stat(path).st_uid == uid
+
+
+def get_forwarded_env(environ):
+    """Get environment variables which affect sabacan command.
+
+    Args:
+        environ (dict): Environment variables.
+    Returns:
+        dict: The environment variables to be forwarded.
+    """
+    return {key: value for key, value in environ.items()
+            if key.startswith(_FORWARDED_ENV_PREFIXES)}
+
+
+def send_frame(sock, channel, payload=b''):
+    """Send a frame to the socket.
+
+    Args:
+        sock (socket.socket): The connected socket.
+        channel (bytes): One byte channel identifier.
+        payload (bytes): The frame payload.
+    """
+    sock.sendall(_HEADER.pack(channel, len(payload)) + payload)
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError('Connection closed')
+        data += chunk
+    return data
+
+
+def recv_frame(sock):
+    """Receive a frame from the socket.
+
+    Args:
+        sock (socket.socket): The connected socket.
+    Returns:
+        (bytes, bytes): The channel identifier and the payload.
+    Raises:
+        EOFError: If the connection is closed.
+    """
+    channel, size = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return channel, _recv_exactly(sock, size)
+
+
+def _forward_stdin(sock, requests):
+    # Reads are done in this thread, so that outputs are written while
+    # the command waits for input
+    try:
+        fileno = sys.stdin.fileno()
+        while True:
+            requests.get()
+            chunk = os.read(fileno, 65536)
+            send_frame(sock, STDIN, chunk)
+            if not chunk:
+                return
+    except (OSError, ValueError):
+        try:
+            send_frame(sock, STDIN) # the end of input
+        except OSError:
+            pass
+
+
+def _run_in_daemon(sock, argv):
+    request = {
+        'argv': argv,
+        'cwd': os.getcwd(),
+        'env': get_forwarded_env(os.environ),
+    }
+    send_frame(sock, ARGS, json.dumps(request).encode('utf-8'))
+    stdin_requests = queue.Queue()
+    threading.Thread(target=_forward_stdin, args=(sock, stdin_requests),
+                     daemon=True).start()
+    while True:
+        channel, payload = recv_frame(sock)
+        if channel == STDOUT:
+            sys.stdout.buffer.write(payload)
+            sys.stdout.buffer.flush()
+        elif channel == STDERR:
+            sys.stderr.buffer.write(payload)
+            sys.stderr.buffer.flush()
+        elif channel == STDIN_REQUEST:
+            stdin_requests.put(None)
+        elif channel == EXIT:
+            return struct.unpack('!i', payload)[0]
+
+
+def main(argv=None):
+    """Run sabacan command by the daemon, or in process if not available.
+
+    Args:
+        argv (list): Command line arguments without program name.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    path = get_socket_path()
+    sock = None
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        if not _is_owned_by_user(sock, path):
+            print('sabacan: Ignoring daemon of another user on %s' % path,
+                  file=sys.stderr)
+            raise PermissionError(path)
+    except (AttributeError, OSError):
+        if sock is not None:
+            sock.close()
+        sabacan.main(argv)
+        return
+    with sock:
+        try:
+            code = _run_in_daemon(sock, argv)
+        except (EOFError, OSError) as ex:
+            print('sabacan: Lost connection to daemon: %s' % ex,
+                  file=sys.stderr)
+            code = 1
+        sys.exit(code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""This module provides persistent HTTP connections for long running
+processes.
+
+`urllib.request` opens a new connection for each request.
+ConnectionPool keeps idle connections per server, and sends later
+requests over them. Idle connections are shared by threads, so that
+they survive worker threads which are created for each command.
+Redirects and proxies are not supported.
+"""
+import collections
+import http.client
+import io
+import threading
+import urllib.error
+import urllib.parse
+
+import sabacan.tracing
+
+# Errors which mean that the server closed the idle connection
+_STALE_CONNECTION_ERRORS = (
+    http.client.BadStatusLine, # including RemoteDisconnected
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+# Maximum number of idle connections kept per server
+_MAX_IDLE_CONNECTIONS = 16
+
+
+class ConnectionPool:
+    """Pool of persistent HTTP connections per server."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle_connections = collections.defaultdict(list)
+
+    def _acquire(self, key):
+        with self._lock:
+            connections = self._idle_connections.get(key)
+            return connections.pop() if connections else None
+
+    def _release(self, key, connection):
+        with self._lock:
+            connections = self._idle_connections[key]
+            if len(connections) < _MAX_IDLE_CONNECTIONS:
+                connections.append(connection)
+                return
+        connection.close()
+
+    @staticmethod
+    def _connect(url, timeout, ssl_context):
+        if url.scheme == 'https':
+            return http.client.HTTPSConnection(
+                url.netloc, timeout=timeout, context=ssl_context)
+        return http.client.HTTPConnection(url.netloc, timeout=timeout)
+
+    @staticmethod
+    def _get_headers(request):
+        headers = dict(request.header_items())
+        if request.data is not None and 'Content-type' not in headers:
+            headers['Content-type'] = 'application/x-www-form-urlencoded'
+        return headers
+
+    def _send(self, connection, request, timeout):
+        connection.timeout = timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout)
+        connection.request(request.get_method(), request.selector,
+                           body=request.data,
+                           headers=self._get_headers(request))
+        response = connection.getresponse()
+        return response, response.read()
+
+    def read(self, request, timeout=None, ssl_context=None):
+        """Send HTTP request and read the response body.
+
+        Args:
+            request (urllib.request.Request): The request.
+            timeout (int): The server communication timeout in seconds.
+            ssl_context (ssl.SSLContext): SSL Context for server communication.
+        Returns:
+            bytes: The response body.
+        Raises:
+            urllib.error.HTTPError: If some server error occurs.
+            urllib.error.URLError: If some protocol error occurs.
+        """
+        url = urllib.parse.urlsplit(request.full_url)
+        key = (url.scheme, url.netloc)
+        while True:
+            connection = self._acquire(key)
+            is_reused = connection is not None
+            try:
+                if connection is None:
+                    connection = self._connect(url, timeout, ssl_context)
+                    # Name resolution, TCP and TLS handshakes
+                    with sabacan.tracing.span('connect', host=url.netloc):
+                        connection.connect()
+                response, body = self._send(connection, request, timeout)
+            except _STALE_CONNECTION_ERRORS as error:
+                connection.close()
+                if is_reused:
+                    continue # Retry with a new connection
+                raise urllib.error.URLError(error)
+            except OSError as error:
+                connection.close()
+                raise urllib.error.URLError(error)
+            break
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(key, connection)
+        if response.status >= 400:
+            raise urllib.error.HTTPError(
+                request.full_url, response.status, response.reason,
+                response.headers, io.BytesIO(body))
+        return body
@@ -0,0 +1,278 @@
+"""This module provides sabacan daemon which executes sabacan commands
+requested by the thin client (`sabacan.client`) over Unix domain socket.
+
+The daemon keeps subcommand modules imported, so that module-level
+caches and HTTP connections are reused across requests. Worker thread
+pools are created for each command.
+Requests are executed by worker processes forked when the daemon
+starts. Each worker executes requests one by one, because a command
+changes process-wide state such as current directory, environment
+variables and standard streams, and workers execute requests
+concurrently, so that a long-lived session such as --stdin-ndjson or
+redpen-lsp does not block other clients.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import time
+import traceback
+
+import sabacan
+import sabacan.client
+import sabacan.plantuml # pylint: disable=unused-import
+import sabacan.redpen # pylint: disable=unused-import
+import sabacan.utils
+from sabacan.client import send_frame, recv_frame
+
+_DEFAULT_NUM_WORKERS = 4
+# Workers which exit sooner than this (sec) are respawned after this delay
+_RESPAWN_DELAY = 1.0
+
+
+class _FrameWriter(io.RawIOBase):
+    def __init__(self, sock, channel):
+        super(_FrameWriter, self).__init__()
+        self._sock = sock
+        self._channel = channel
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        data = bytes(b)
+        if data:
+            send_frame(self._sock, self._channel, data)
+        return len(data)
+
+
+class _FrameReader(io.RawIOBase):
+    def __init__(self, sock):
+        super(_FrameReader, self).__init__()
+        self._sock = sock
+        self._buffer = b''
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer and not self._eof:
+            try:
+                # The client reads its input only on request
+                send_frame(self._sock, sabacan.client.STDIN_REQUEST)
+                channel, payload = recv_frame(self._sock)
+            except (EOFError, OSError):
+                self._eof = True
+                break
+            if channel == sabacan.client.STDIN:
+                self._buffer = payload
+                self._eof = not payload
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+class _StderrHandler(logging.Handler):
+    """Logging handler which writes to the current sys.stderr.
+
+    This prevents logging.basicConfig from binding the root logger to
+    the standard error of the first request.
+    """
+    def __init__(self):
+        super(_StderrHandler, self).__init__()
+        self.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+    def emit(self, record):
+        try:
+            sys.stderr.write(self.format(record) + '\n')
+            sys.stderr.flush()
+        except Exception: # pylint: disable=broad-except
+            self.handleError(record)
+
+
+def _make_text_stream(raw, mode):
+    if mode == 'r':
+        return io.TextIOWrapper(io.BufferedReader(raw), encoding='utf-8')
+    return io.TextIOWrapper(io.BufferedWriter(raw), encoding='utf-8',
+                            line_buffering=True)
+
+
+def _replace_env(env):
+    for key in list(sabacan.client.get_forwarded_env(os.environ)):
+        del os.environ[key]
+    os.environ.update(env)
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            channel, payload = recv_frame(self.request)
+        except EOFError:
+            return
+        if channel != sabacan.client.ARGS:
+            return
+        request = json.loads(payload.decode('utf-8'))
+        code = self._run(request)
+        try:
+            send_frame(self.request, sabacan.client.EXIT,
+                       struct.pack('!i', code))
+        except OSError:
+            pass
+
+    def _run(self, request):
+        saved_cwd = os.getcwd()
+        saved_env = dict(os.environ)
+        saved_streams = (sys.stdin, sys.stdout, sys.stderr)
+        sys.stdin = _make_text_stream(_FrameReader(self.request), 'r')
+        sys.stdout = _make_text_stream(
+            _FrameWriter(self.request, sabacan.client.STDOUT), 'w')
+        sys.stderr = _make_text_stream(
+            _FrameWriter(self.request, sabacan.client.STDERR), 'w')
+        code = 0
+        try:
+            os.chdir(request['cwd'])
+            _replace_env(request['env'])
+            sabacan.main(request['argv'])
+        except SystemExit as ex:
+            if ex.code is None:
+                code = 0
+            elif isinstance(ex.code, int):
+                code = ex.code
+            else:
+                print(ex.code, file=sys.stderr)
+                code = 1
+        except Exception: # pylint: disable=broad-except
+            traceback.print_exc()
+            code = 1
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            except OSError:
+                pass
+            sys.stdin, sys.stdout, sys.stderr = saved_streams
+            os.environ.clear()
+            os.environ.update(saved_env)
+            os.chdir(saved_cwd)
+        return code
+
+
+def _remove_stale_socket(path):
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError('sabacan daemon is already running on %s' % path)
+
+
+def _spawn_worker(server):
+    """Fork a worker process which accepts requests on the server.
+
+    Returns:
+        int: The process ID of the worker.
+    """
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    try:
+        # The daemon stops workers on SIGTERM and keyboard interrupt
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        while True:
+            # Another worker may accept the connection first, and this
+            # waits for the next one then
+            server.handle_request()
+    finally:
+        # Not to run the cleanup of the daemon
+        os._exit(1) # pylint: disable=protected-access
+
+def serve(path, num_workers=_DEFAULT_NUM_WORKERS):
+    """Run sabacan daemon until interrupted.
+
+    Args:
+        path (str): The path of Unix domain socket.
+        num_workers (int): The number of worker processes, which is
+            the maximum number of requests executed concurrently.
+    """
+    _remove_stale_socket(path)
+    logging.getLogger().addHandler(_StderrHandler())
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    sabacan.utils.enable_keepalive()
+    server = socketserver.UnixStreamServer(path, _RequestHandler)
+    workers = {}
+    try:
+        os.chmod(path, 0o600)
+        for _ in range(max(num_workers, 1)):
+            workers[_spawn_worker(server)] = time.monotonic()
+        logging.info('Listening on %s with %d workers', path, len(workers))
+        while True:
+            pid, status = os.wait()
+            started = workers.pop(pid, None)
+            if started is None:
+                continue
+            logging.warning('Worker %d exited with status %d', pid, status)
+            if time.monotonic() - started < _RESPAWN_DELAY:
+                time.sleep(_RESPAWN_DELAY)
+            workers[_spawn_worker(server)] = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        server.server_close()
+        os.unlink(path)
+
+
+def make_parser(parser_constructor=argparse.ArgumentParser):
+    """Make argparse parser object for sabacan daemon.
+    """
+    parser = parser_constructor(
+        'serve',
+        description='Run sabacan daemon for sabacan-client command')
+    parser.add_argument(
+        '--socket', '-s',
+        help='Unix domain socket path (default: %(default)s)',
+        action='store',
+        metavar='PATH',
+        default=sabacan.client.get_socket_path())
+    parser.add_argument(
+        '--workers', '-j',
+        help=('Number of worker processes, which execute requests '
+              'concurrently (default: %(default)s)'),
+        action='store',
+        type=int,
+        metavar='N',
+        default=_DEFAULT_NUM_WORKERS)
+    parser.set_defaults(main_function=main)
+    return parser
+
+
+def main(args):
+    """Run action as serve command.
+
+    Args:
+        args: Parsing result from the parser created by `make_parser`.
+    """
+    try:
+        serve(args.socket, args.workers)
+    except (RuntimeError, OSError) as ex:
+        logging.error('Failed to run daemon: %s', ex)
+        sys.exit(1)
@@ -0,0 +1,138 @@
+"""This module provides functions to extract PlantUML diagrams
+embedded in documents.
+
+The following blocks are supported.
+
+:markdown:
+    Fenced code blocks whose info string is plantuml, puml or uml.
+:asciidoc:
+    Delimited blocks with [plantuml] block attribute.
+:rest:
+    uml and plantuml directives with inline contents.
+"""
+import re
+
+_MARKDOWN_FENCE_PATTERN = re.compile(
+    r'^(?P<indent> {0,3})(?P<fence>`{3,}|~{3,})\s*'
+    r'\{?\.?(?:plantuml|puml|uml)\b')
+_ASCIIDOC_ATTRIBUTE_PATTERN = re.compile(r'^\[plantuml(?:,.*)?\]\s*$')
+_ASCIIDOC_DELIMITER_PATTERN = re.compile(r'^(?:-{4,}|\.{4,})\s*$')
+_REST_DIRECTIVE_PATTERN = re.compile(
+    r'^(?P<indent>\s*)\.\.\s+(?:uml|plantuml)::\s*(?P<argument>.*)$')
+_REST_OPTION_PATTERN = re.compile(r'^\s+:[^:]+:')
+
+SUPPORTED_DOCUMENT_PARSERS = ('markdown', 'asciidoc', 'rest')
+
+
+class EmbeddedDiagram:
+    """PlantUML diagram embedded in a document.
+
+    Attributes:
+        lineno (int): The line number where the block begins.
+        code (str): PlantUML code. @startuml and @enduml are added
+            if the block does not have them.
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('lineno', 'code')
+
+    def __init__(self, lineno, lines):
+        self.lineno = lineno
+        code = '\n'.join(lines).strip('\n')
+        if not code.lstrip().startswith('@start'):
+            code = '@startuml\n' + code + '\n@enduml'
+        self.code = code
+
+
+def _get_indent(line):
+    return len(line) - len(line.lstrip())
+
+def _scan_markdown(lines):
+    for lineno, line in lines:
+        match = _MARKDOWN_FENCE_PATTERN.match(line)
+        if match is None:
+            continue
+        start, indent = lineno, len(match.group('indent'))
+        fence = match.group('fence')
+        body = []
+        for lineno, line in lines:
+            stripped = line.strip()
+            if (stripped.startswith(fence)
+                    and not stripped.lstrip(fence[0])):
+                break
+            indent_len = min(indent, _get_indent(line))
+            body.append(line[indent_len:])
+        yield EmbeddedDiagram(start, body)
+
+def _scan_asciidoc(lines):
+    for lineno, line in lines:
+        if _ASCIIDOC_ATTRIBUTE_PATTERN.match(line) is None:
+            continue
+        start = lineno
+        for lineno, line in lines:
+            if line.strip():
+                break
+        else:
+            return
+        if _ASCIIDOC_DELIMITER_PATTERN.match(line) is None:
+            continue
+        delimiter = line.strip()
+        body = []
+        for lineno, line in lines:
+            if line.strip() == delimiter:
+                break
+            body.append(line)
+        yield EmbeddedDiagram(start, body)
+
+def _scan_rest(lines):
+    pending = None
+    while True:
+        if pending is None:
+            pending = next(lines, None)
+            if pending is None:
+                return
+        lineno, line = pending
+        pending = None
+        match = _REST_DIRECTIVE_PATTERN.match(line)
+        if match is None or match.group('argument').strip():
+            continue
+        start, indent = lineno, len(match.group('indent'))
+        body = []
+        in_options = True
+        for lineno, line in lines:
+            if line.strip() and _get_indent(line) <= indent:
+                pending = (lineno, line)
+                break
+            if in_options and _REST_OPTION_PATTERN.match(line):
+                continue
+            in_options = False
+            body.append(line)
+        body_indent = min(
+            (_get_indent(line) for line in body if line.strip()), default=0)
+        yield EmbeddedDiagram(start, [line[body_indent:] for line in body])
+
+_SCANNER_MAP = {
+    'markdown': _scan_markdown,
+    'asciidoc': _scan_asciidoc,
+    'rest': _scan_rest,
+}
+
+
+def iter_diagrams(lines, document_parser):
+    """Extract PlantUML diagrams from document lines.
+
+    Lines are scanned one by one, so that the whole document is
+    not required to be loaded into memory.
+
+    Args:
+        lines (iterable): The lines of document.
+        document_parser (str): Document format
+            (one of SUPPORTED_DOCUMENT_PARSERS).
+    Yields:
+        EmbeddedDiagram: The embedded diagram.
+    """
+    scanner = _SCANNER_MAP.get(document_parser)
+    if scanner is None:
+        return
+    numbered_lines = (
+        (lineno, line.rstrip('\r\n')) for lineno, line in enumerate(lines, 1))
+    yield from scanner(numbered_lines)
@@ -0,0 +1,134 @@
+"""This module provides an encoder of HTTP form data.
+
+Fields are encoded as `application/x-www-form-urlencoded` or
+`multipart/form-data`. Multipart form data sends UTF-8 text as is,
+while URL encoding expands each non-ASCII byte to three bytes.
+Encoded fields which are sent repeatedly (e.g. configuration) are cached,
+and request bodies can be compressed by gzip.
+"""
+import collections
+import gzip
+import threading
+import time
+import urllib.parse
+import uuid
+
+ENCODINGS = ['form', 'multipart']
+
+# Maximum number of cached encoded fields (e.g. configurations)
+_FIELD_CACHE_SIZE = 32
+
+_PART_HEADER = ('Content-Disposition: form-data; name="%s"\r\n'
+                'Content-Type: text/plain; charset=utf-8\r\n\r\n')
+
+
+def encode_urlencoded_field(name, value):
+    """Encode a field as a pair of URL encoded form.
+
+    Args:
+        name (str): The field name.
+        value (str): The field value.
+    Returns:
+        bytes: The encoded field.
+    """
+    return (urllib.parse.quote_plus(name) + '='
+            + urllib.parse.quote_plus(value)).encode('ascii')
+
+
+def encode_multipart_field(name, value):
+    """Encode a field as a part of multipart form data without boundary.
+
+    Args:
+        name (str): The field name.
+        value (str): The field value.
+    Returns:
+        bytes: The encoded field.
+    """
+    return (_PART_HEADER % name).encode('utf8') + value.encode('utf8')
+
+
+class FormEncoder:
+    """Encoder of form data which records upload statistics.
+
+    Args:
+        encoding (str): 'form' or 'multipart'.
+        compress (bool): Whether or not to compress bodies by gzip.
+    """
+    def __init__(self, encoding='form', compress=False):
+        if encoding not in ENCODINGS:
+            raise ValueError('Unknown encoding: %s' % encoding)
+        self._is_multipart = encoding == 'multipart'
+        self._compress = compress
+        self._boundary = uuid.uuid4().hex
+        self._field_cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._num_requests = 0
+        self._upload_size = 0
+        self._encoded_size = 0
+        self._encoding_time = 0.0
+
+    def _encode_field(self, name, value):
+        if self._is_multipart:
+            return encode_multipart_field(name, value)
+        return encode_urlencoded_field(name, value)
+
+    def _get_cached_field(self, name, value):
+        key = (name, value)
+        with self._lock:
+            field = self._field_cache.get(key)
+            if field is not None:
+                self._field_cache.move_to_end(key)
+                return field
+        field = self._encode_field(name, value)
+        with self._lock:
+            self._field_cache[key] = field
+            if len(self._field_cache) > _FIELD_CACHE_SIZE:
+                self._field_cache.popitem(last=False)
+        return field
+
+    def encode(self, fields, cached_names=()):
+        """Encode fields into a request body.
+
+        Args:
+            fields (dict): The field values. None values are omitted.
+            cached_names (iterable): The names of fields whose encoded
+                values are reused by later requests.
+        Returns:
+            (bytes, dict): The request body, and HTTP headers for it.
+        """
+        start = time.perf_counter()
+        encoded_fields = [
+            self._get_cached_field(name, value) if name in cached_names
+            else self._encode_field(name, value)
+            for name, value in fields.items() if value is not None]
+        if self._is_multipart:
+            delimiter = b'--' + self._boundary.encode('ascii')
+            body = b''.join(
+                [delimiter + b'\r\n' + field + b'\r\n'
+                 for field in encoded_fields] + [delimiter + b'--\r\n'])
+            headers = {'Content-Type':
+                       'multipart/form-data; boundary=' + self._boundary}
+        else:
+            body = b'&'.join(encoded_fields)
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        encoded_size = len(body)
+        if self._compress:
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        duration = time.perf_counter() - start
+        with self._lock:
+            self._num_requests += 1
+            self._upload_size += len(body)
+            self._encoded_size += encoded_size
+            self._encoding_time += duration
+        return (body, headers)
+
+    def format_stats(self):
+        """Get the summary of upload statistics"""
+        with self._lock:
+            stats = ('Upload: %d requests, %d bytes, encoding %.3f sec'
+                     % (self._num_requests, self._upload_size,
+                        self._encoding_time))
+            if self._compress:
+                stats += ' (%d bytes before compression)' % self._encoded_size
+        return stats
@@ -0,0 +1,156 @@
+"""This module provides request hedging to cut tail latency.
+
+If a request has not completed within a percentile of recent latencies,
+a duplicate request is sent to another backend (or to the same backend
+over another connection), and the reply which arrives first is used.
+The number of duplicate requests is capped by a budget ratio
+to the number of requests.
+"""
+import collections
+import threading
+import time
+
+import sabacan.utils
+
+_WINDOW_SIZE = 100
+_MIN_SAMPLES = 20
+_MAX_WORKERS = 64
+
+
+class Hedger:
+    """Hedged request sender.
+
+    Args:
+        base_url (str): URL of the primary backend.
+        backend_urls (list): URLs of backends which duplicate requests
+            are sent to. If empty, duplicates are sent to the primary.
+        percentile (float): The percentile (0-100) of recent latencies
+            after which a duplicate request is sent.
+        budget (float): The maximum ratio of duplicate requests
+            to requests.
+    """
+    def __init__(self, base_url, backend_urls=(), percentile=95.0,
+                 budget=0.05):
+        self._base_url = base_url
+        self._backend_urls = list(backend_urls) or [base_url]
+        self._ratio = percentile / 100.0
+        self._budget = budget
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=_WINDOW_SIZE)
+        self._num_requests = 0
+        self._num_hedges = 0
+        self._next_backend = 0
+        self._executor = None
+
+    @property
+    def num_hedges(self):
+        """Get the number of sent duplicate requests"""
+        return self._num_hedges
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Losing requests are abandoned, and must not delay exit
+                self._executor = sabacan.utils.DaemonThreadPool(_MAX_WORKERS)
+            return self._executor
+
+    def _get_delay(self):
+        with self._lock:
+            if len(self._latencies) < _MIN_SAMPLES:
+                return None
+            latencies = sorted(self._latencies)
+            index = min(int(len(latencies) * self._ratio), len(latencies) - 1)
+            return latencies[index]
+
+    def _try_reserve_hedge(self):
+        with self._lock:
+            if self._num_hedges + 1 > self._budget * self._num_requests:
+                return None
+            self._num_hedges += 1
+            backend_url = self._backend_urls[
+                self._next_backend % len(self._backend_urls)]
+            self._next_backend += 1
+            return backend_url
+
+    def _make_hedge_request(self, request, backend_url):
+        url = request.full_url
+        if url.startswith(self._base_url):
+            url = backend_url + url[len(self._base_url):]
+        return type(request)(
+            url, request.data, dict(request.header_items()),
+            method=request.get_method())
+
+    def _timed_send(self, sender, request):
+        start = time.monotonic()
+        result = sender(request)
+        with self._lock:
+            self._latencies.append(time.monotonic() - start)
+        return result
+
+    def send(self, request, sender):
+        """Send the request, and a duplicate if it is slow.
+
+        Args:
+            request (urllib.request.Request): The request to the primary.
+            sender (callable): The function which sends a request and
+                returns the response body.
+        Returns:
+            bytes: The response body which arrives first.
+        """
+        with self._lock:
+            self._num_requests += 1
+        delay = self._get_delay()
+        if delay is None:
+            return self._timed_send(sender, request)
+
+        futures = sabacan.utils.futures
+        executor = self._get_executor()
+        pending = {executor.submit(self._timed_send, sender, request)}
+        done, pending = futures.wait(pending, timeout=delay)
+        if not done:
+            backend_url = self._try_reserve_hedge()
+            if backend_url is not None:
+                hedge_request = self._make_hedge_request(request, backend_url)
+                pending.add(executor.submit(
+                    self._timed_send, sender, hedge_request))
+        error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        # A running request can not be interrupted,
+                        # so that it is abandoned without waiting, and
+                        # its reply is discarded.
+                        loser.cancel()
+                    return future.result()
+                if error is None:
+                    error = future.exception()
+            if not pending:
+                raise error
+            done, pending = futures.wait(
+                pending, return_when=futures.FIRST_COMPLETED)
+
+
+_HEDGER_TABLE = {}
+_HEDGER_TABLE_LOCK = threading.Lock()
+
+
+def get_hedger(base_url, backend_urls, percentile, budget):
+    """Get the hedger shared by the communication to the server.
+
+    Args:
+        base_url (str): URL of the primary backend.
+        backend_urls (list): URLs of backends for duplicate requests.
+        percentile (float): The percentile of recent latencies
+            after which a duplicate request is sent.
+        budget (float): The maximum ratio of duplicate requests.
+    Returns:
+        Hedger: The hedger for the server.
+    """
+    key = (base_url, tuple(backend_urls), percentile, budget)
+    with _HEDGER_TABLE_LOCK:
+        hedger = _HEDGER_TABLE.get(key)
+        if hedger is None:
+            hedger = _HEDGER_TABLE[key] = Hedger(
+                base_url, backend_urls, percentile, budget)
+        return hedger
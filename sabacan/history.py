@@ -0,0 +1,126 @@
+"""This module provides a history-based cost model of server processing.
+
+Durations of previous runs are stored in a small JSON file,
+and are used to estimate durations of the next run.
+"""
+import heapq
+import json
+import logging
+import os
+import pathlib
+import threading
+
+_SMOOTHING_FACTOR = 0.5
+_DEFAULT_BASE_COST = 0.05
+_DEFAULT_COST_PER_BYTE = 1e-5
+
+
+def predict_makespan(costs, jobs):
+    """Predict the total duration of processing in the given order.
+
+    Each item is assigned to the worker which becomes idle first.
+
+    Args:
+        costs (iterable): The estimated durations in processing order.
+        jobs (int): The number of workers.
+    Returns:
+        float: The predicted makespan.
+    """
+    workers = [0.0] * max(jobs or 1, 1)
+    for cost in costs:
+        heapq.heappush(workers, heapq.heappop(workers) + cost)
+    return max(workers)
+
+
+class History:
+    """Store of durations of previous runs.
+
+    Args:
+        path (str or pathlib.Path): The path to JSON file to store durations.
+            If the file does not exist, the history is empty.
+    """
+    def __init__(self, path):
+        self._path = pathlib.Path(path)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._cost_per_byte = None
+        try:
+            with self._path.open(encoding='utf-8') as history_file:
+                self._entries = json.load(history_file)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as ex:
+            logging.warning('%s: Failed to load history: %s', self._path, ex)
+
+    def _get_cost_per_byte(self):
+        if self._cost_per_byte is not None:
+            return self._cost_per_byte
+        total_size = sum(entry['size'] for entry in self._entries.values())
+        if total_size == 0:
+            self._cost_per_byte = _DEFAULT_COST_PER_BYTE
+        else:
+            total_duration = sum(
+                max(entry['duration'] - _DEFAULT_BASE_COST, 0)
+                for entry in self._entries.values())
+            self._cost_per_byte = total_duration / total_size
+        return self._cost_per_byte
+
+    def estimate(self, key, size):
+        """Estimate the duration of processing.
+
+        Args:
+            key (str): The key of the processed item (e.g. path of file).
+            size (int): The size of the processed item in bytes.
+                This is used if the key has no history.
+        Returns:
+            float: The estimated duration in seconds.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            return entry['duration']
+        return _DEFAULT_BASE_COST + size * self._get_cost_per_byte()
+
+    def order(self, items, jobs, get_key, get_size):
+        """Sort items in longest-first order.
+
+        Args:
+            items (iterable): The items to be processed.
+            jobs (int): The number of workers.
+            get_key (callable): The function to get key from an item.
+            get_size (callable): The function to get size from an item.
+        Returns:
+            (list, float): The sorted items and the predicted makespan.
+        """
+        costs = [(self.estimate(get_key(item), get_size(item)), index, item)
+                 for index, item in enumerate(items)]
+        costs.sort(key=lambda cost: (-cost[0], cost[1]))
+        makespan = predict_makespan((cost[0] for cost in costs), jobs)
+        return [cost[2] for cost in costs], makespan
+
+    def record(self, key, size, duration):
+        """Record the duration of processing.
+
+        Args:
+            key (str): The key of the processed item.
+            size (int): The size of the processed item in bytes.
+            duration (float): The duration in seconds.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                duration = (_SMOOTHING_FACTOR * duration
+                            + (1 - _SMOOTHING_FACTOR) * entry['duration'])
+            self._entries[key] = {'duration': duration, 'size': size}
+            self._cost_per_byte = None
+
+    def save(self):
+        """Write the history into the file."""
+        with self._lock:
+            temp_path = self._path.with_name(self._path.name + '.tmp')
+            try:
+                with temp_path.open('w', encoding='utf-8') as history_file:
+                    json.dump(self._entries, history_file)
+                os.replace(str(temp_path), str(self._path))
+            except OSError as ex:
+                logging.warning(
+                    '%s: Failed to save history: %s', self._path, ex)
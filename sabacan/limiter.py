@@ -0,0 +1,138 @@
+"""This module provides an adaptive concurrency limiter for server
+communication.
+
+The limiter increases the number of concurrent requests additively
+while latency stays flat, and decreases it multiplicatively when
+the server looks overloaded (timeout, 429 or 503).
+It also computes per-request timeouts from the observed latency
+distribution and the payload size.
+"""
+import collections
+import threading
+
+_WINDOW_SIZE = 100
+_MIN_SAMPLES = 10
+_FLAT_LATENCY_TOLERANCE = 2.0
+_DECREASE_FACTOR = 0.5
+_TIMEOUT_PERCENTILE = 0.99
+_TIMEOUT_MULTIPLIER = 4.0
+_MIN_TIMEOUT = 3.0
+_MAX_TIMEOUT = 900.0
+
+OVERLOAD_STATUS_CODES = (429, 503)
+
+
+def _percentile(sorted_values, ratio):
+    index = min(int(len(sorted_values) * ratio), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limiter with latency-aware timeouts.
+
+    Args:
+        initial_limit (int): The initial number of concurrent requests.
+        min_limit (int): The minimum number of concurrent requests.
+        max_limit (int): The maximum number of concurrent requests.
+    """
+    def __init__(self, initial_limit=1, min_limit=1, max_limit=64):
+        self._condition = threading.Condition()
+        self._limit = float(initial_limit)
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._in_flight = 0
+        self._samples = collections.deque(maxlen=_WINDOW_SIZE)
+
+    @property
+    def limit(self):
+        """Get the current number of allowed concurrent requests"""
+        return int(self._limit)
+
+    @property
+    def max_limit(self):
+        """Get the maximum number of concurrent requests"""
+        return self._max_limit
+
+    def acquire(self):
+        """Wait until a request is allowed to be sent."""
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self):
+        """Notify the end of a request."""
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def _get_size_factor(self, size):
+        sizes = sorted(sample[1] for sample in self._samples)
+        median_size = max(_percentile(sizes, 0.5), 1)
+        return max(1.0, size / median_size)
+
+    def get_timeout(self, size, max_timeout=None):
+        """Get the timeout for a request.
+
+        Args:
+            size (int): The payload size of the request in bytes.
+            max_timeout (int): The upper bound of the timeout.
+        Returns:
+            float: The timeout in seconds. If there are not enough samples,
+                max_timeout is returned.
+        """
+        with self._condition:
+            if len(self._samples) < _MIN_SAMPLES:
+                return max_timeout
+            latencies = sorted(sample[0] for sample in self._samples)
+            timeout = (_TIMEOUT_MULTIPLIER
+                       * _percentile(latencies, _TIMEOUT_PERCENTILE)
+                       * self._get_size_factor(size))
+        upper = max_timeout if max_timeout is not None else _MAX_TIMEOUT
+        return min(max(timeout, _MIN_TIMEOUT), upper)
+
+    def on_success(self, latency, size):
+        """Record a successful request.
+
+        Args:
+            latency (float): The latency of the request in seconds.
+            size (int): The payload size of the request in bytes.
+        """
+        with self._condition:
+            if self._samples:
+                latencies = sorted(sample[0] for sample in self._samples)
+                baseline = (_percentile(latencies, 0.5)
+                            * self._get_size_factor(size))
+                is_flat = latency <= baseline * _FLAT_LATENCY_TOLERANCE
+            else:
+                is_flat = True
+            self._samples.append((latency, size))
+            if is_flat and self._limit < self._max_limit:
+                self._limit = min(self._limit + 1.0 / int(self._limit),
+                                  float(self._max_limit))
+                self._condition.notify()
+
+    def on_overload(self):
+        """Record a request failed because of server overload."""
+        with self._condition:
+            self._limit = max(self._limit * _DECREASE_FACTOR,
+                              float(self._min_limit))
+
+
+_LIMITER_TABLE = {}
+_LIMITER_TABLE_LOCK = threading.Lock()
+
+
+def get_limiter(servername):
+    """Get the limiter shared by the communication to the server.
+
+    Args:
+        servername (str): The name of application (e.g. plantuml)
+    Returns:
+        AdaptiveLimiter: The limiter for the server.
+    """
+    with _LIMITER_TABLE_LOCK:
+        limiter = _LIMITER_TABLE.get(servername)
+        if limiter is None:
+            limiter = _LIMITER_TABLE[servername] = AdaptiveLimiter()
+        return limiter
@@ -0,0 +1,485 @@
+"""This module provides RedPen diagnostics server for editors.
+
+The server speaks a subset of Language Server Protocol (JSON-RPC over
+standard input and output). It validates documents opened in the editor
+by RedPen server, and publishes the errors as diagnostics.
+
+Validation is debounced while the document is edited. Validations
+which are outdated by later edits are cancelled if they are not started,
+and their results are discarded otherwise.
+HTTP connections, languages and configurations are reused while
+the server is running.
+"""
+import argparse
+import json
+import logging
+import os
+import pathlib
+import re
+import sys
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import sabacan
+import sabacan.redpen
+import sabacan.utils
+
+# Resolution of languages and configurations is shared with redpen command
+# pylint: disable=protected-access
+
+_LANGUAGE_ID_TABLE = {
+    'markdown': 'markdown',
+    'plaintext': 'plain',
+    'asciidoc': 'asciidoc',
+    'latex': 'latex',
+    'tex': 'latex',
+    'restructuredtext': 'rest',
+    'rst': 'rest',
+    'review': 'review',
+    'properties': 'properties',
+    'ini': 'properties',
+}
+_SEVERITY_TABLE = {
+    'error': 1,
+    'warn': 2,
+    'warning': 2,
+    'info': 3,
+}
+_DEFAULT_SEVERITY = 2
+
+_LINE_BREAK_PATTERN = re.compile(r'\r\n|\r|\n')
+
+# JSON-RPC error codes
+_PARSE_ERROR = -32700
+_METHOD_NOT_FOUND = -32601
+_INVALID_REQUEST = -32600
+_INTERNAL_ERROR = -32603
+
+# Text document sync kind
+_SYNC_FULL = 1
+
+
+def make_parser(parser_constructor=argparse.ArgumentParser):
+    """Make argparse parser object for RedPen diagnostics server.
+    """
+    parser = parser_constructor(
+        'redpen-lsp',
+        usage='%(prog)s [Options]',
+        description=('RedPen diagnostics server for editors '
+                     '(Language Server Protocol over stdio)'),
+        add_help=False)
+    parser.add_argument(
+        '--conf', '-c',
+        help='Configuration file',
+        action='store',
+        metavar='<CONF FILE>')
+    parser.add_argument(
+        '--lang', '-L',
+        help='Language of error messages (%(choices)s)',
+        action='store',
+        choices=['en', 'ja'],
+        metavar='<LANGUAGE>')
+    parser.add_argument(
+        '--debounce',
+        help=('Delay (sec) of validation after the last edit '
+              '(default: %(default)s)'),
+        action='store',
+        type=float,
+        metavar='<SEC>',
+        default=0.5)
+    parser.add_argument(
+        '--jobs', '-j',
+        help=('Number of documents validated concurrently '
+              '(default: %(default)d)'),
+        action='store',
+        type=int,
+        metavar='<N>',
+        default=2)
+    parser.add_argument(
+        '--help', '-h',
+        help='Displays this help information and exits',
+        action='help')
+    parser.set_defaults(main_function=main)
+    return parser
+
+
+class MessageError(ValueError):
+    """Exception for a message which can not be parsed."""
+
+
+def read_message(stream):
+    """Read a JSON-RPC message with Content-Length header.
+
+    Args:
+        stream (io.BufferedIOBase): The input stream.
+    Returns:
+        dict: The message. If the stream reaches EOF, return None.
+    Raises:
+        MessageError: If the header or the body is invalid.
+            The message is skipped, and the next message can be read.
+    """
+    headers = []
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.rstrip(b'\r\n')
+        if line:
+            headers.append(line)
+        elif headers:
+            break
+    length = None
+    for header in headers:
+        name, _, value = header.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            try:
+                length = int(value)
+            except ValueError:
+                raise MessageError('Invalid Content-Length: %s' % value.strip())
+    if length is None or length < 0:
+        raise MessageError('Content-Length header is missing or invalid')
+    body = stream.read(length)
+    if len(body) < length:
+        return None
+    try:
+        return json.loads(body.decode('utf8'))
+    except ValueError as error:
+        raise MessageError('Invalid JSON: %s' % error)
+
+
+def write_message(stream, message):
+    """Write a JSON-RPC message with Content-Length header.
+
+    Args:
+        stream (io.BufferedIOBase): The output stream.
+        message (dict): The message.
+    """
+    body = json.dumps(message, ensure_ascii=False).encode('utf8')
+    stream.write(b'Content-Length: %d\r\n\r\n' % len(body) + body)
+    stream.flush()
+
+
+def uri_to_path(uri):
+    """Convert file URI to path.
+
+    Args:
+        uri (str): The URI of document.
+    Returns:
+        pathlib.Path: The path. If uri is not file URI, return None.
+    """
+    url = urllib.parse.urlsplit(uri)
+    if url.scheme != 'file':
+        return None
+    return pathlib.Path(urllib.request.url2pathname(url.path))
+
+
+def _to_position(lines, line, offset):
+    # LSP counts characters in UTF-16 code units, and RedPen in characters
+    if 0 <= line < len(lines):
+        offset = len(lines[line][:offset].encode('utf-16-le')) // 2
+    return {'line': line, 'character': offset}
+
+
+def to_diagnostic(error, lines=()):
+    """Convert an error entry of json format into LSP diagnostic.
+
+    Args:
+        error (sabacan.redpen.ValidationError): The error.
+        lines (list): The lines of the validated text, which are used
+            to convert offsets into UTF-16 code units.
+    Returns:
+        dict: The diagnostic.
+    """
+    data = error.data
+    start = data.get('startPosition')
+    end = data.get('endPosition')
+    if start is not None and end is not None:
+        diagnostic_range = {
+            'start': _to_position(lines, start['lineNum'] - 1,
+                                  start.get('offset', 0)),
+            'end': _to_position(lines, end['lineNum'] - 1,
+                                end.get('offset', 0)),
+        }
+    else:
+        line = max((error.line_num or 1) - 1, 0)
+        diagnostic_range = {
+            'start': _to_position(lines, line,
+                                  data.get('sentenceStartColumnNum', 0)),
+            'end': {'line': line + 1, 'character': 0},
+        }
+    return {
+        'range': diagnostic_range,
+        'severity': _SEVERITY_TABLE.get(
+            str(data.get('level', '')).lower(), _DEFAULT_SEVERITY),
+        'code': data.get('validator'),
+        'source': 'RedPen',
+        'message': data.get('message', ''),
+    }
+
+
+class _OpenDocument:
+    # pylint: disable=too-few-public-methods
+    def __init__(self, uri, language_id, version, text):
+        self.uri = uri
+        self.path = uri_to_path(uri)
+        self.language_id = language_id
+        self.version = version
+        self.text = text
+        self.generation = 0
+        self.timer = None
+        self.future = None
+        self.lang = None
+
+
+class DiagnosticsServer:
+    """Server which publishes RedPen errors as diagnostics.
+
+    Args:
+        base_url (str): URL of RedPen server.
+        options (dict): Options of server communication.
+        args: Parsing result from the parser created by `make_parser`.
+        output (io.BufferedIOBase): The output stream.
+    """
+    def __init__(self, base_url, options, args, output):
+        self._base_url = base_url
+        self._options = options
+        self._args = args
+        self._output = output
+        self._output_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._documents = {}
+        self._executor = sabacan.utils.futures.ThreadPoolExecutor(args.jobs)
+        self._config_finder = sabacan.redpen._ConfigFinder()
+        self._global_config = None
+        self._global_lang = None
+        if args.conf is not None:
+            self._global_config = pathlib.Path(args.conf).read_text(
+                encoding='utf8')
+            self._global_lang = sabacan.redpen._get_lang_from_config(
+                self._global_config)
+        self.is_shutdown = False
+        self._handlers = {
+            'initialize': self._initialize,
+            'shutdown': self._shutdown,
+            'textDocument/didOpen': self._did_open,
+            'textDocument/didChange': self._did_change,
+            'textDocument/didSave': self._did_save,
+            'textDocument/didClose': self._did_close,
+        }
+
+    def _send(self, message):
+        message['jsonrpc'] = '2.0'
+        with self._output_lock:
+            write_message(self._output, message)
+
+    def send_parse_error(self, reason):
+        """Send the error response to a message which can not be parsed.
+
+        Args:
+            reason (str): The error message.
+        """
+        self._send({'id': None, 'error': {
+            'code': _PARSE_ERROR, 'message': reason}})
+
+    def handle(self, message):
+        """Handle a JSON-RPC message.
+
+        Args:
+            message (dict): The request or notification.
+        """
+        if not isinstance(message, dict):
+            self._send({'id': None, 'error': {
+                'code': _INVALID_REQUEST, 'message': 'Invalid request'}})
+            return
+        method = message.get('method')
+        msgid = message.get('id')
+        handler = self._handlers.get(method)
+        if handler is None:
+            if msgid is not None:
+                self._send({'id': msgid, 'error': {
+                    'code': (_METHOD_NOT_FOUND if method is not None
+                             else _INVALID_REQUEST),
+                    'message': 'Unsupported method: %s' % method}})
+            return
+        try:
+            result = handler(message.get('params') or {})
+        except Exception as error: # pylint: disable=broad-except
+            logging.exception('Failed to handle %s', method)
+            if msgid is not None:
+                self._send({'id': msgid, 'error': {
+                    'code': _INTERNAL_ERROR, 'message': str(error)}})
+            return
+        if msgid is not None:
+            self._send({'id': msgid, 'result': result})
+
+    def _initialize(self, _params):
+        return {
+            'capabilities': {
+                'textDocumentSync': {
+                    'openClose': True,
+                    'change': _SYNC_FULL,
+                    'save': {'includeText': False},
+                },
+            },
+            'serverInfo': {'name': 'sabacan', 'version': sabacan.__version__},
+        }
+
+    def _shutdown(self, _params):
+        self.is_shutdown = True
+        with self._lock:
+            for document in self._documents.values():
+                if document.timer is not None:
+                    document.timer.cancel()
+        self._executor.shutdown(wait=False)
+
+    def _did_open(self, params):
+        text_document = params['textDocument']
+        document = _OpenDocument(
+            text_document['uri'], text_document.get('languageId'),
+            text_document.get('version'), text_document['text'])
+        with self._lock:
+            self._documents[document.uri] = document
+        self._schedule(document.uri, 0)
+
+    def _did_change(self, params):
+        text_document = params['textDocument']
+        with self._lock:
+            document = self._documents.get(text_document['uri'])
+            if document is None:
+                return
+            for change in params['contentChanges']:
+                if 'range' not in change:
+                    document.text = change['text']
+            document.version = text_document.get('version')
+        self._schedule(document.uri, self._args.debounce)
+
+    def _did_save(self, params):
+        self._schedule(params['textDocument']['uri'], 0)
+
+    def _did_close(self, params):
+        uri = params['textDocument']['uri']
+        with self._lock:
+            document = self._documents.pop(uri, None)
+            if document is not None and document.timer is not None:
+                document.timer.cancel()
+        self._publish(uri, None, [])
+
+    def _schedule(self, uri, delay):
+        with self._lock:
+            document = self._documents.get(uri)
+            if document is None or self.is_shutdown:
+                return
+            document.generation += 1
+            generation = document.generation
+            if document.timer is not None:
+                document.timer.cancel()
+            # Outdated validations which are not started are cancelled
+            if document.future is not None:
+                document.future.cancel()
+                document.future = None
+            document.timer = threading.Timer(
+                delay, self._submit, (document, generation))
+            document.timer.daemon = True
+            document.timer.start()
+
+    def _submit(self, document, generation):
+        with self._lock:
+            if document.generation != generation:
+                return
+            try:
+                document.future = self._executor.submit(
+                    self._validate, document, generation)
+            except RuntimeError: # shutdown
+                pass
+
+    def _is_stale(self, document, generation):
+        with self._lock:
+            return (document.generation != generation
+                    or self._documents.get(document.uri) is not document)
+
+    def _get_document_parser(self, document):
+        if document.path is not None:
+            parser = sabacan.redpen.get_document_parser_from_filename(
+                document.path.name)
+            if parser is not None:
+                return parser
+        return _LANGUAGE_ID_TABLE.get(document.language_id, 'plain')
+
+    def _get_lang_and_config(self, document, text):
+        if self._global_config is not None:
+            return (self._global_lang, self._global_config)
+        if document.lang is None:
+            document.lang = self._args.lang
+            if document.lang is None:
+                document.lang = sabacan.redpen._get_document_language(
+                    self._base_url, self._options, text)
+        directory = (document.path.parent if document.path is not None
+                     else pathlib.Path('.'))
+        with self._lock:
+            config = self._config_finder.read(document.lang, directory)
+        return (document.lang, config)
+
+    def _validate(self, document, generation):
+        with self._lock:
+            text = document.text
+            version = document.version
+        if self._is_stale(document, generation):
+            return
+        try:
+            lang, config = self._get_lang_and_config(document, text)
+            result = sabacan.redpen.validate(
+                self._base_url, text, self._get_document_parser(document),
+                lang, 'json', config=config, structured=True,
+                **self._options)
+        except urllib.error.HTTPError as error:
+            with error:
+                logging.error('Failed to validate %s (%d %s): %s',
+                              document.uri, error.code, error.reason,
+                              error.read())
+            return
+        except Exception: # pylint: disable=broad-except
+            logging.exception('Failed to validate %s', document.uri)
+            return
+        # The document was edited while validating
+        if self._is_stale(document, generation):
+            logging.debug('Discard outdated result of %s', document.uri)
+            return
+        lines = _LINE_BREAK_PATTERN.split(text)
+        self._publish(document.uri, version,
+                      [to_diagnostic(error, lines) for error in result.errors])
+
+    def _publish(self, uri, version, diagnostics):
+        params = {'uri': uri, 'diagnostics': diagnostics}
+        if version is not None:
+            params['version'] = version
+        self._send({'method': 'textDocument/publishDiagnostics',
+                    'params': params})
+
+
+def main(args):
+    """Run RedPen diagnostics server until exit notification.
+
+    Args:
+        args: Parsing result from the parser created by `make_parser`.
+    """
+    base_url, options = sabacan.utils.get_connection_info(
+        'redpen', default_url=sabacan.redpen._DEFAULT_SERVER_URL)
+    sabacan.utils.enable_keepalive()
+    if args.conf is not None and not os.path.isfile(args.conf):
+        logging.error('%s is not file', args.conf)
+        sys.exit(1)
+    server = DiagnosticsServer(base_url, options, args, sys.stdout.buffer)
+    while True:
+        try:
+            message = read_message(sys.stdin.buffer)
+        except MessageError as error:
+            logging.warning('Skipped invalid message: %s', error)
+            server.send_parse_error(str(error))
+            continue
+        if message is None:
+            sys.exit(1)
+        if isinstance(message, dict) and message.get('method') == 'exit':
+            sys.exit(0 if server.is_shutdown else 1)
+        server.handle(message)
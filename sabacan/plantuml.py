@@ -12,17 +12,28 @@ This module may use the following environment variables.
 """
 import argparse
 import base64
+import codecs
 import glob
+import hashlib
 import io
+import json
 import logging
+import mmap
 import os
 import pathlib
 import sys
+import time
 import urllib.error
 import urllib.request
 import zlib
 
+import sabacan.archive
+import sabacan.embedded
+import sabacan.history
+import sabacan.sprite
+import sabacan.tracing
 import sabacan.utils
+import sabacan.vcs
 from sabacan.utils import NotSupportedAction, NotSupportedFlagAction
 
 _FROM_CHARS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/='
@@ -46,8 +57,14 @@ _FORMAT_TO_URL_PATTERN_TABLE = {
     'utxt': 'txt',
 }
 
+_SOURCE_SUFFIXES = ('.pu', '.puml', '.plantuml', '.iuml', '.uml', '.wsd')
+
 DEFAULT_SERVER_URL = 'http://%s:%d/plantuml' % ('127.0.0.1', 8080)
 
+# Source files larger than this are memory-mapped instead of read
+_MMAP_THRESHOLD = 1 << 20
+_UTF8_VALIDATION_CHUNK_SIZE = 1 << 16
+
 
 class _FlagAction(argparse.Action):
     """Custom argparse.Action class to display variable information.
@@ -123,7 +140,8 @@ def make_parser(parser_constructor=argparse.ArgumentParser):
         dest='format')
     parser.add_argument(
         '-output', '-o',
-        help='To generate images in the specified directory',
+        help=('To generate images in the specified directory, '
+              'or in the specified zip/tar archive'),
         action='store',
         metavar='"dir"',
         dest='outdir')
@@ -246,9 +264,9 @@ def make_parser(parser_constructor=argparse.ArgumentParser):
     parser.add_argument(
         '-encodesprite',
         help=('To encode a sprite at gray level (z for compression) '
-              'from an image'),
-        action=NotSupportedAction,
-        choices=['4', '8', '16', '4z', '8z', '16z'])
+              'from PNG images (directories are searched for PNG images)'),
+        action='store',
+        choices=sabacan.sprite.LEVELS)
     parser.add_argument(
         '-computeurl', '-encodeurl',
         help='To compute the encoded URL of a PlantUML source file',
@@ -291,11 +309,35 @@ def make_parser(parser_constructor=argparse.ArgumentParser):
     parser.add_argument(
         '-duration',
         help='To print the duration of complete diagrams processing',
-        action=NotSupportedFlagAction)
+        action='store_true')
+    parser.add_argument(
+        '-history',
+        help=('To record durations of diagrams processing in the file, '
+              'and to process slow diagrams first'),
+        action='store',
+        metavar='"file"')
+    parser.add_argument(
+        '-changedsince', '--changed-since',
+        help=('To process only files changed since the merge base of '
+              'the git revision (all changed diagrams if no file is given)'),
+        action='store',
+        dest='changed_since',
+        metavar='"rev"')
+    parser.add_argument(
+        '-postthreshold', '--post-threshold',
+        help=('To send source files of (N) bytes or larger by POST method, '
+              'whose encoded URLs may exceed URL length limits of servers '
+              '(PlantUML server 1.2018.5 or later is required)'),
+        action='store',
+        type=int,
+        dest='post_threshold',
+        metavar='N')
     parser.add_argument(
         '-nbthread',
         help='To use (N) threads for processing',
-        action=NotSupportedAction,
+        action='store',
+        type=int,
+        default=1,
         metavar='N')
     parser.add_argument(
         '-timeout',
@@ -412,6 +454,17 @@ def make_parser(parser_constructor=argparse.ArgumentParser):
         '-cypher',
         help='To cypher texts of diagrams so that you can share them',
         action=NotSupportedFlagAction)
+    parser.add_argument(
+        '-embedded',
+        help=('To generate images of diagrams embedded in '
+              'Markdown, AsciiDoc and reStructuredText documents'),
+        action='store_true')
+    parser.add_argument(
+        '-embeddedmap',
+        help=('To write a JSON map from each embedded diagram location '
+              'to its image with -embedded option'),
+        action='store',
+        metavar='"file"')
     parser.add_argument(
         'file/dir',
         help='UML files',
@@ -433,15 +486,18 @@ def encode_code(uml_code, level=-1):
     (http://plantuml.com/en/text-encoding).
 
     Args:
-        uml_code (str): PlantUML code.
+        uml_code (str or bytes-like): PlantUML code. bytes-like code must
+            be encoded in UTF-8.
         level (int): Compressing level.
     Returns:
         str: The PlantUML Text Encoding text.
     """
-    byte_code = uml_code.encode('utf-8')
-    compressed_code = zlib.compress(byte_code, level)[2:-4]
-    base64_code = base64.b64encode(compressed_code).decode('ascii')
-    return ''.join(_ENCODE_TABLE[c] for c in base64_code)
+    with sabacan.tracing.span('encode', size=len(uml_code)):
+        if isinstance(uml_code, str):
+            uml_code = uml_code.encode('utf-8')
+        compressed_code = zlib.compress(uml_code, level)[2:-4]
+        base64_code = base64.b64encode(compressed_code).decode('ascii')
+        return ''.join(_ENCODE_TABLE[c] for c in base64_code)
 
 
 def decode_code(encoded_uml):
@@ -460,18 +516,23 @@ def decode_code(encoded_uml):
 
 
 def compile_code(base_url, uml_code, output_format, use_post=False,
-                 timeout=None, user_agent=None, ssl_context=None):
+                 timeout=None, user_agent=None, ssl_context=None,
+                 limiter=None, hedger=None):
     # pylint: disable=too-many-arguments
     """Compile PlantUML code into the specified format data by PlantUML server.
 
     Args:
         base_url (str): URL of PlantUML server.
-        uml_code (str): PlantUML code.
+        uml_code (str or bytes-like): PlantUML code. bytes-like code
+            (e.g. bytes, memoryview or mmap) must be encoded in UTF-8,
+            and is sent without copying for POST method.
         output_format (str): The target format.
         use_post (bool): Whether or not to use HTTP POST method for compiling.
             PlantUML server supports POST method from version 1.2018.5.
         timeout (int): The server communication timeout in seconds.
         ssl_context (ssl.SSLContext): SSL Context for server communication.
+        limiter (sabacan.limiter.AdaptiveLimiter): Concurrency limiter.
+        hedger (sabacan.hedging.Hedger): Request hedger.
     Returns:
         bytes: output data with the specified format.
     Raises:
@@ -483,7 +544,9 @@ def compile_code(base_url, uml_code, output_format, use_post=False,
     pattern = _FORMAT_TO_URL_PATTERN_TABLE.get(output_format, output_format)
     if use_post:
         url = base_url + '/' + pattern + '/'
-        data = uml_code.encode('utf-8')
+        data = uml_code
+        if isinstance(data, str):
+            data = data.encode('utf-8')
         headers['Content-Type'] = 'text/plain;charset="UTF-8"'
         request = urllib.request.Request(url, data, headers)
     else:
@@ -491,9 +554,9 @@ def compile_code(base_url, uml_code, output_format, use_post=False,
         url = base_url + '/' + pattern + '/' + encoded_uml
         request = urllib.request.Request(url, headers=headers)
     try:
-        with urllib.request.urlopen(
-                request, timeout=timeout, context=ssl_context) as response:
-            return response.read()
+        return sabacan.utils.urlread(
+            request, timeout=timeout, ssl_context=ssl_context,
+            limiter=limiter, hedger=hedger)
     except urllib.error.HTTPError as error:
         with error:
             if error.code != 400:
@@ -501,22 +564,26 @@ def compile_code(base_url, uml_code, output_format, use_post=False,
             raise CompileError(error.reason, error.read())
 
 
-def get_language(base_url, timeout=None, user_agent=None, ssl_context=None):
+def get_language(base_url, timeout=None, user_agent=None, ssl_context=None,
+                 limiter=None, hedger=None):
     """Get PlantUML languange information.
 
     Args:
         base_url (str): URL of PlantUML server.
         timeout (int): The server communication timeout in seconds.
         ssl_context (ssl.SSLContext): SSL Context for server communication.
+        limiter (sabacan.limiter.AdaptiveLimiter): Concurrency limiter.
+        hedger (sabacan.hedging.Hedger): Request hedger.
     Returns:
         str: PlantUML language information.
     """
+    # pylint: disable=too-many-arguments
     url = base_url + '/language'
     headers = sabacan.utils.make_headers(user_agent)
     request = urllib.request.Request(url, headers=headers)
-    with urllib.request.urlopen(
-            request, timeout=timeout, context=ssl_context) as response:
-        return response.read().decode('utf8')
+    return sabacan.utils.urlread(
+        request, timeout=timeout, ssl_context=ssl_context,
+        limiter=limiter, hedger=hedger).decode('utf8')
 
 
 def format_to_ext(output_format):
@@ -537,27 +604,82 @@ def format_to_ext(output_format):
     return '.' + output_format
 
 
-def _generate(base_url, options,
-              filepath, output_format, outdir, output_filepath=None):
+def _get_archive_name(filepath, outdir):
+    if isinstance(filepath, sabacan.archive.ArchiveMember):
+        return pathlib.PurePosixPath(outdir) / filepath.path
+    path = pathlib.PurePath(os.path.normpath(str(filepath)))
+    if '..' in path.parts:
+        # Not to go up out of the archive root
+        path = filepath.resolve()
+    return pathlib.PurePath(outdir) / path.relative_to(path.anchor)
+
+def _validate_utf8(data):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    with memoryview(data) as view:
+        # Decoded chunks are discarded not to hold the whole text
+        starts = range(0, len(view), _UTF8_VALIDATION_CHUNK_SIZE)
+        for start in list(starts) + [len(view)]:
+            end = min(start + _UTF8_VALIDATION_CHUNK_SIZE, len(view))
+            try:
+                decoder.decode(view[start:end], final=start == len(view))
+            except UnicodeDecodeError as error:
+                # error.object is the chunk following undecoded bytes
+                raise ValueError('Invalid UTF-8 at byte %d: %s' % (
+                    end - len(error.object) + error.start, error.reason))
+
+def _read_source(filepath):
+    """Read source file as bytes-like object validated as UTF-8.
+
+    Large files are memory-mapped, and returned as memoryview.
+    The mapping is released when the view is garbage collected,
+    since a hedged request may still be sending it after the reply
+    arrives.
+    """
+    if (isinstance(filepath, sabacan.archive.ArchiveMember)
+            or filepath.stat().st_size < _MMAP_THRESHOLD):
+        data = filepath.read_bytes()
+    else:
+        with filepath.open('rb') as source:
+            mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        # Not to be sent as a file object by http.client
+        data = memoryview(mapped)
+    _validate_utf8(data)
+    return data
+
+def _generate(base_url, options, filepath, output_format, outdir,
+              output_filepath=None, writer=None, post_threshold=None):
     # pylint: disable=too-many-arguments
-    uml_code = filepath.read_text(encoding='utf-8')
+    with sabacan.tracing.span('read', path=str(filepath)):
+        uml_code = _read_source(filepath)
+    use_post = post_threshold is not None and len(uml_code) >= post_threshold
     try:
-        reply = compile_code(base_url, uml_code, output_format, **options)
+        reply = compile_code(base_url, uml_code, output_format,
+                             use_post=use_post, **options)
         result = True
     except CompileError as error:
         logging.warning('%s: %s', filepath, error)
         reply = error.data
         result = False
 
-    if output_filepath is None:
-        output_filepath = filepath.parent / outdir / filepath.name
-        output_filepath.parent.mkdir(parents=True, exist_ok=True)
-    output_filepath = output_filepath.with_suffix(format_to_ext(output_format))
-    output_filepath.write_bytes(reply)
+    with sabacan.tracing.span('write', path=str(filepath)):
+        if writer is not None:
+            name = _get_archive_name(filepath, outdir)
+            writer.write(name.with_suffix(format_to_ext(output_format)), reply)
+            return result
+        if output_filepath is None:
+            if isinstance(filepath, sabacan.archive.ArchiveMember):
+                output_filepath = (filepath.archive.parent / outdir
+                                   / filepath.path)
+            else:
+                output_filepath = filepath.parent / outdir / filepath.name
+            output_filepath.parent.mkdir(parents=True, exist_ok=True)
+        output_filepath = output_filepath.with_suffix(
+            format_to_ext(output_format))
+        output_filepath.write_bytes(reply)
     return result
 
 def _check_syntax(base_url, options, filepath):
-    uml_code = filepath.read_text(encoding='utf-8')
+    uml_code = _read_source(filepath)
     try:
         reply = compile_code(
             base_url, uml_code, 'check', use_post=False, **options)
@@ -566,17 +688,16 @@ def _check_syntax(base_url, options, filepath):
         logging.warning('%s: %s', filepath, error)
         reply = error.data
         result = False
-    print(filepath, ':', reply.decode('utf-8'))
-    return result
+    # Printed by the caller, not to mix lines of files processed in parallel
+    return (result, '%s : %s' % (filepath, reply.decode('utf-8')))
 
 def _encodeurl(filepath):
     try:
-        uml_code = filepath.read_text(encoding='utf-8')
-        print(filepath, ':', encode_code(uml_code))
+        output = '%s : %s' % (filepath, encode_code(_read_source(filepath)))
     except Exception as ex: # pylint: disable=broad-except
-        logging.error('Failed to encode %s: %s', uml_code, ex)
-        return False
-    return True
+        logging.error('Failed to encode %s: %s', filepath, ex)
+        return (False, None)
+    return (True, output)
 
 def _decodeurl(encoded_uml):
     try:
@@ -586,28 +707,245 @@ def _decodeurl(encoded_uml):
         return False
     return True
 
-def _for_each_file(paths, proc, do_exit=False):
-    result = True
+def _iter_paths(paths):
+    # Archives are yielded as they are, and expanded by _expand_archives
     for path in paths:
         path = os.path.expandvars(os.path.expanduser(path))
         do_process = False
-        for filepath in glob.iglob(path, recursive=True):
+        filepaths = glob.iglob(path, recursive=True)
+        if sabacan.tracing.is_enabled():
+            # The walk is measured as a whole only when tracing, and files
+            # are processed while walking otherwise
+            with sabacan.tracing.span('walk', path=path):
+                filepaths = list(filepaths)
+        for filepath in filepaths:
             filepath = pathlib.Path(filepath)
             if not filepath.is_file():
                 continue
             do_process = True
-            try:
-                result = proc(filepath) and result
-            except Exception: # pylint: disable=broad-except
-                logging.exception('%s: Failed to process', filepath)
-                result = False
+            yield filepath
         if not do_process:
             logging.warning('%s is invalid path', path)
             continue
+
+def _expand_archives(filepaths, failures):
+    for filepath in filepaths:
+        if not sabacan.archive.is_archive(filepath):
+            yield filepath
+            continue
+        try:
+            yield from sabacan.archive.iter_members(
+                filepath, _SOURCE_SUFFIXES, failures)
+        except Exception: # pylint: disable=broad-except
+            logging.exception('%s: Failed to read archive', filepath)
+            failures.append(filepath)
+
+def _iter_files(paths, failures):
+    return _expand_archives(_iter_paths(paths), failures)
+
+def _get_changed_paths(paths, changes, suffixes=None):
+    if not paths:
+        return [glob.escape(str(filepath)) for filepath in changes.files
+                if suffixes is None
+                or filepath.suffix in suffixes
+                or sabacan.archive.is_archive(filepath)]
+    changed_paths = []
+    for path in paths:
+        path = os.path.expandvars(os.path.expanduser(path))
+        for filepath in glob.iglob(path, recursive=True):
+            if filepath in changes:
+                changed_paths.append(glob.escape(filepath))
+            else:
+                logging.debug('%s is not changed', filepath)
+    return changed_paths
+
+def _iter_image_files(paths, recurse, failures):
+    pattern = '**/*.png' if recurse else '*.png'
+    for path in paths:
+        path = os.path.expandvars(os.path.expanduser(path))
+        filepaths = sorted(glob.iglob(path, recursive=True))
+        if not filepaths:
+            logging.warning('%s is invalid path', path)
+            failures.append(path)
+        for filepath in map(pathlib.Path, filepaths):
+            if filepath.is_dir():
+                yield from sorted(filepath.glob(pattern))
+            elif filepath.is_file():
+                yield filepath
+
+def _encode_sprite(filepath, level):
+    # Run in worker processes, so errors are returned instead of logged.
+    # Any error is caught, so that one broken image does not stop others.
+    try:
+        return (sabacan.sprite.encode_sprite_file(filepath, level), None)
+    except Exception as error: # pylint: disable=broad-except
+        return (None, '%s: Failed to encode sprite: %s' % (filepath, error))
+
+def _run_with_encodesprite(paths, args):
+    failures = []
+    filepaths = list(_iter_image_files(paths, args.recurse, failures))
+    levels = [args.encodesprite] * len(filepaths)
+    result = not failures
+    if args.nbthread > 1 and len(filepaths) > 1:
+        executor = sabacan.utils.futures.ProcessPoolExecutor(args.nbthread)
+        # Small icons are sent to workers in chunks to amortize IPC
+        chunksize = max(1, len(filepaths) // (args.nbthread * 4))
+        sprites = executor.map(_encode_sprite, filepaths, levels,
+                               chunksize=chunksize)
+    else:
+        executor = None
+        sprites = map(_encode_sprite, filepaths, levels)
+    try:
+        for sprite, error in sprites:
+            if error is not None:
+                logging.error('%s', error)
+                result = False
+                continue
+            sys.stdout.write(sprite)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    sys.exit(0 if result else 1)
+
+def _get_file_size(filepath):
+    if isinstance(filepath, sabacan.archive.ArchiveMember):
+        return len(filepath.read_bytes())
+    return filepath.stat().st_size
+
+def _for_each_file(paths, proc, do_exit=False, jobs=1,
+                   history=None, show_duration=False, limiter=None,
+                   has_output=False):
+    # pylint: disable=too-many-arguments,too-many-locals
+    # If has_output is True, proc returns the result and the text to be
+    # printed, and texts are printed in the order of files.
+    def safe_proc(filepath):
+        start = time.monotonic()
+        output = None
+        try:
+            result = proc(filepath)
+            if has_output:
+                result, output = result
+        except Exception: # pylint: disable=broad-except
+            logging.exception('%s: Failed to process', filepath)
+            return (False, None)
+        # Durations of failed runs do not predict the next run
+        if result and history is not None:
+            history.record(str(filepath), _get_file_size(filepath),
+                           time.monotonic() - start)
+        return (result, output)
+
+    start = time.monotonic()
+    failures = []
+    filepaths = _iter_paths(paths)
+    predicted = None
+    if history is not None:
+        # Only paths are sorted, and archives are expanded when dispatched,
+        # so that archive members are not loaded into memory at once
+        filepaths, predicted = history.order(
+            filepaths, jobs, get_key=str,
+            get_size=lambda filepath: filepath.stat().st_size)
+    files = _expand_archives(filepaths, failures)
+    result = True
+    for proc_result, output in sabacan.utils.parallel_map(
+            safe_proc, files, jobs, limiter=limiter):
+        if output is not None:
+            print(output)
+        result = proc_result and result
+    result = result and not failures
+    if history is not None:
+        history.save()
+    if show_duration:
+        duration = time.monotonic() - start
+        if predicted is None:
+            print('Duration: %.3f sec' % duration, file=sys.stderr)
+        else:
+            print('Duration: %.3f sec (predicted makespan: %.3f sec)'
+                  % (duration, predicted), file=sys.stderr)
     if do_exit:
         sys.exit(0 if result else 1)
     return result
 
+def _collect_embedded_diagrams(paths, failures):
+    # RedPen module is imported only for -embedded option
+    import sabacan.redpen # pylint: disable=import-outside-toplevel
+    diagrams = {}
+    locations = []
+    for filepath in _iter_files(paths, failures):
+        document_parser = sabacan.redpen.get_document_parser_from_filename(
+            filepath.name)
+        if document_parser not in sabacan.embedded.SUPPORTED_DOCUMENT_PARSERS:
+            continue
+        try:
+            if isinstance(filepath, sabacan.archive.ArchiveMember):
+                lines = io.StringIO(filepath.read_text(encoding='utf-8'))
+            else:
+                lines = filepath.open(encoding='utf-8')
+            with lines:
+                for diagram in sabacan.embedded.iter_diagrams(
+                        lines, document_parser):
+                    digest = hashlib.sha1(
+                        diagram.code.encode('utf-8')).hexdigest()
+                    diagrams.setdefault(digest, diagram.code)
+                    locations.append((filepath, diagram.lineno, digest))
+        except Exception: # pylint: disable=broad-except
+            logging.exception('%s: Failed to scan', filepath)
+            failures.append(filepath)
+    return diagrams, locations
+
+def _run_with_embedded(base_url, options, args):
+    if args.outdir is not None and sabacan.archive.is_archive(args.outdir):
+        logging.error('-embedded option can not write into archive: %s',
+                      args.outdir)
+        sys.exit(1)
+    input_paths = getattr(args, 'file/dir')
+    outdir = pathlib.Path(args.outdir if args.outdir is not None else '.')
+    ext = format_to_ext(args.format)
+    failures = []
+    diagrams, locations = _collect_embedded_diagrams(input_paths, failures)
+
+    # Only successful renders are stored under the hash name, which is
+    # regarded as cached by the next run. Error images are stored under
+    # another name, so that failed diagrams are compiled again.
+    failed_digests = set()
+
+    def render(item):
+        digest, uml_code = item
+        output_filepath = outdir / (digest + ext)
+        error_filepath = outdir / (digest + '.error' + ext)
+        if output_filepath.exists():
+            return True
+        try:
+            reply = compile_code(base_url, uml_code, args.format, **options)
+        except CompileError as error:
+            logging.warning('%s: %s', output_filepath, error)
+            error_filepath.write_bytes(error.data)
+            failed_digests.add(digest)
+            return False
+        except Exception: # pylint: disable=broad-except
+            logging.exception('%s: Failed to process', output_filepath)
+            return False
+        # An interrupted write must not leave a partial image as cached
+        temp_filepath = outdir / (digest + ext + '.tmp')
+        temp_filepath.write_bytes(reply)
+        os.replace(str(temp_filepath), str(output_filepath))
+        if error_filepath.exists():
+            error_filepath.unlink()
+        return True
+
+    outdir.mkdir(parents=True, exist_ok=True)
+    result = all(list(sabacan.utils.parallel_map(
+        render, sorted(diagrams.items()), args.nbthread,
+        limiter=options['limiter'])))
+    if args.embeddedmap is not None:
+        embedded_map = {
+            '%s:%d' % (filepath, lineno): str(outdir / (
+                digest + ('.error' if digest in failed_digests else '') + ext))
+            for filepath, lineno, digest in locations
+        }
+        with open(args.embeddedmap, 'w', encoding='utf-8') as map_file:
+            json.dump(embedded_map, map_file, ensure_ascii=False, indent=2)
+    sys.exit(0 if result and not failures else 1)
+
 def _read_uml_code(stdin):
     code_lines = []
     for line in stdin:
@@ -658,18 +996,42 @@ def main(args):
         _run_with_pipe(base_url, options, args)
 
     input_paths = getattr(args, 'file/dir')
+    if args.changed_since is not None and not args.decodeurl:
+        try:
+            changes = sabacan.vcs.ChangeSet(args.changed_since)
+        except sabacan.vcs.GitError as error:
+            logging.error('%s', error)
+            sys.exit(1)
+        if args.embedded:
+            suffixes = None
+        elif args.encodesprite is not None:
+            suffixes = ('.png',)
+        else:
+            suffixes = _SOURCE_SUFFIXES
+        input_paths = _get_changed_paths(input_paths, changes, suffixes)
+        if not input_paths:
+            logging.info('No changed files')
+            sys.exit(0)
+    if args.encodesprite is not None:
+        _run_with_encodesprite(input_paths, args)
+
     if args.computeurl:
-        _for_each_file(input_paths, _encodeurl, do_exit=True)
+        _for_each_file(input_paths, _encodeurl, do_exit=True,
+                       jobs=args.nbthread, has_output=True)
 
     if args.decodeurl:
         result = all(_decodeurl(encoded_uml) for encoded_uml in input_paths)
         sys.exit(0 if result else 1)
 
+    if args.embedded:
+        _run_with_embedded(base_url, options, args)
+
     if args.syntax:
         _for_each_file(
             input_paths,
             lambda path: _check_syntax(base_url, options, path),
-            do_exit=True)
+            do_exit=True, jobs=args.nbthread, limiter=options['limiter'],
+            has_output=True)
 
     if args.outfile is not None:
         outfile = pathlib.Path(args.outfile)
@@ -678,6 +1040,19 @@ def main(args):
             sys.exit(1)
     else:
         outfile = None
+    history = None
+    if args.history is not None:
+        history = sabacan.history.History(args.history)
+    if args.outdir is not None and sabacan.archive.is_archive(args.outdir):
+        with sabacan.archive.ArchiveWriter(args.outdir) as writer:
+            result = _for_each_file(
+                input_paths,
+                lambda path: _generate(
+                    base_url, options, path, args.format, '', writer=writer,
+                    post_threshold=args.post_threshold),
+                jobs=args.nbthread, history=history,
+                show_duration=args.duration, limiter=options['limiter'])
+        sys.exit(0 if result else 1)
     if args.outdir is not None:
         outdir = pathlib.Path(args.outdir) # TODO argument value check
     else:
@@ -686,8 +1061,10 @@ def main(args):
     _for_each_file(
         input_paths,
         lambda path: _generate(
-            base_url, options, path, args.format, outdir, outfile),
-        do_exit=True)
+            base_url, options, path, args.format, outdir, outfile,
+            post_threshold=args.post_threshold),
+        do_exit=True, jobs=args.nbthread, history=history,
+        show_duration=args.duration, limiter=options['limiter'])
 
 
 if __name__ == '__main__':
@@ -11,23 +11,34 @@ This module may use the following environment variables.
     does not exist, use SABACAN_TIMEOUT instead.
 """
 import argparse
+import bisect
+import collections
+import fnmatch
+import glob
+import hashlib
+import io
 import json
 import logging
 import os
 import pathlib
 import re
 import sys
+import threading
+import time
 import urllib.error
 import urllib.parse
 import urllib.request
-try:
-    from lxml import etree as ET
-except ImportError:
-    from xml.etree import ElementTree as ET
 
+import sabacan.cache
+import sabacan.chunking
+import sabacan.formdata
+import sabacan.tracing
 import sabacan.utils
+import sabacan.vcs
 from sabacan.utils import NotSupportedAction
 
+ET = sabacan.utils.LazyModule('lxml.etree', 'xml.etree.ElementTree')
+
 
 _SERVER_HOST = '127.0.0.1'
 _SERVER_PORT = 8080
@@ -43,6 +54,74 @@ _PARSER_EXTENSIONS_LIST = [
         ('properties', ['properties']),
 ]
 _FORMAT_LIST = ['json', 'json2', 'plain', 'plain2', 'xml']
+_LANGUAGE_SAMPLE_SIZE = 4096
+_JA_CHAR_RANGES = [
+    (0x3000, 0x30ff), # CJK symbols and punctuation, Hiragana and Katakana
+    (0x3400, 0x4dbf), # CJK unified ideographs extension A
+    (0x4e00, 0x9fff), # CJK unified ideographs
+    (0xff00, 0xffef), # Halfwidth and fullwidth forms
+]
+_KANA_CHAR_RANGE = (0x3040, 0x30ff)
+_JA_RATIO_THRESHOLD = 0.1
+_EN_RATIO_THRESHOLD = 0.01
+# Languages of recently validated documents by their digests
+_LANGUAGE_CACHE = collections.OrderedDict()
+_LANGUAGE_CACHE_LOCK = threading.Lock()
+_LANGUAGE_CACHE_SIZE = 4096
+_CONFIG_CACHE_SIZE = 32
+# Open batches of --stdin-ndjson are sent after this (sec) even if not full
+_BATCH_FLUSH_INTERVAL = 0.1
+# Document parsers which always separate paragraphs by blank lines
+_BATCH_PARSERS = ['plain', 'properties']
+_DOCUMENT_VALIDATORS = [
+    'Contraction',
+    'DuplicateSection',
+    'FrequentSentenceStart',
+    'GappedSection',
+    'JapaneseExpressionVariation',
+    'JapaneseStyle',
+    'KatakanaSpellCheck',
+    'ParagraphNumber',
+    'SectionLength',
+    'SectionLevel',
+    'SuccessiveSentence',
+    'UnexpandedAcronym',
+    'VoidSection',
+    'WordFrequency',
+]
+# Validators which see only a sentence, so that documents validated
+# together in a batch do not affect errors of each other
+_SENTENCE_VALIDATORS = [
+    'CommaNumber',
+    'DoubleNegative',
+    'DoubledConjunctiveParticleGa',
+    'DoubledJoshi',
+    'DoubledWord',
+    'EndOfSentence',
+    'HankakuKana',
+    'InvalidExpression',
+    'InvalidSymbol',
+    'InvalidWord',
+    'JapaneseAmbiguousNounConjunction',
+    'JapaneseJoyoKanji',
+    'JapaneseNumberExpression',
+    'KatakanaEndHyphen',
+    'LongKanjiChain',
+    'NumberFormat',
+    'Okurigana',
+    'ParenthesizedSentence',
+    'Quotation',
+    'SentenceLength',
+    'SpaceBeginningOfSentence',
+    'SpaceBetweenAlphabeticalWord',
+    'Spelling',
+    'StartWithCapitalLetter',
+    'SuccessiveWord',
+    'SuggestExpression',
+    'SymbolWithSpace',
+    'WeakExpression',
+    'WordNumber',
+]
 
 
 def make_parser(parser_constructor=argparse.ArgumentParser):
@@ -106,49 +185,207 @@ def make_parser(parser_constructor=argparse.ArgumentParser):
         '--version', '-v',
         action='store_true',
         help='Displays version information and exits')
+    parser.add_argument(
+        '--jobs', '-j',
+        help=('Number of concurrent requests for documents and their '
+              'chunks (default: %(default)d)'),
+        action='store',
+        type=int,
+        metavar='<N>',
+        default=1)
+    parser.add_argument(
+        '--chunk-size',
+        help=('Split documents larger than the size (characters) along '
+              'headings and paragraphs, and validate the chunks '
+              'concurrently'),
+        action='store',
+        type=int,
+        metavar='<SIZE>')
+    parser.add_argument(
+        '--batch-size',
+        help=('Pack plain text and properties documents smaller than '
+              'the size (bytes) into requests of up to the size, if they '
+              'share the language and the configuration file, and '
+              'the configuration has only validators of sentences'),
+        action='store',
+        type=int,
+        metavar='<SIZE>')
+    parser.add_argument(
+        '--stream',
+        help=('Output the result of each document as soon as validated '
+              '(NDJSON for json formats)'),
+        action='store_true')
+    parser.add_argument(
+        '--cache',
+        help=('Cache results of paragraphs and sections in the directory, '
+              'and revalidate only changed ones'),
+        action='store',
+        metavar='<CACHE DIR>')
+    parser.add_argument(
+        '--document-validators',
+        help=('Comma separated validators which are applied to whole '
+              'documents even if --cache is specified (default: %(default)s)'),
+        action='store',
+        type=lambda names: [name for name in names.split(',') if name],
+        metavar='<VALIDATORS>',
+        default=','.join(_DOCUMENT_VALIDATORS))
+    parser.add_argument(
+        '--changed-since',
+        help=('Validate only documents changed since the merge base of '
+              'the git revision (all changed documents if no input is given)'),
+        action='store',
+        metavar='<REV>')
+    parser.add_argument(
+        '--changed-lines',
+        help='Report only errors in changed lines with --changed-since',
+        action='store_true')
+    parser.add_argument(
+        '--request-encoding',
+        help=('Encoding of request bodies (%(choices)s) '
+              '(default: %(default)s)'),
+        action='store',
+        choices=sabacan.formdata.ENCODINGS,
+        metavar='<ENCODING>',
+        default='form')
+    parser.add_argument(
+        '--gzip-request',
+        help='Compress request bodies by gzip (the server must accept it)',
+        action='store_true')
+    parser.add_argument(
+        '--upload-stats',
+        help='Print the upload size and the encoding time to stderr',
+        action='store_true')
+    parser.add_argument(
+        '--stdin-ndjson',
+        help=('Read JSON objects with id, document and optional parser, '
+              'lang and config (XML file name in --config-dir) from '
+              'standard input line by line, and write a result line for '
+              'each of them'),
+        action='store_true')
+    parser.add_argument(
+        '--config-dir',
+        help=('Directory of configuration files named by config of '
+              '--stdin-ndjson lines (default: current directory)'),
+        action='store',
+        metavar='<DIR>',
+        default='.')
+    parser.add_argument(
+        '--fail-fast',
+        help=('Stop validation as soon as the number of errors exceeds '
+              'the limit, and output the partial result'),
+        action='store_true')
+    parser.add_argument(
+        '--exclude', '-x',
+        help=('Exclude files and directories matching the glob pattern '
+              'from input directories (can be specified multiple times)'),
+        action='append',
+        metavar='<PATTERN>',
+        dest='excludes',
+        default=[])
     parser.add_argument(
         'input_files',
-        help='Input document',
+        help=('Input document, directory (searched recursively) '
+              'or glob pattern'),
         nargs='*',
         metavar='<INPUT FILE>')
     parser.set_defaults(main_function=main)
     return parser
 
 
-def get_default_configfile(lang):
+class _ConfigFinder:
+    """Finder of default RedPen XML configuration files.
+
+    Results of file probes and searches are memoized per directory,
+    so that documents in the same tree share the directory walk.
+    """
+    def __init__(self):
+        self._is_file_cache = {}
+        self._search_cache = {}
+        self._config_cache = {}
+
+    def _is_file(self, path):
+        result = self._is_file_cache.get(path)
+        if result is None:
+            result = self._is_file_cache[path] = path.is_file()
+        return result
+
+    def _search_conf(self, dirpath, lang):
+        for name in ('redpen-conf.xml', 'redpen-conf-' + lang + '.xml'):
+            conf = dirpath / name
+            if self._is_file(conf):
+                return conf
+        return None
+
+    def find(self, lang, start_dir='.'):
+        """Find the configuration file nearest to the directory.
+
+        Args:
+            lang (str): The languange which searched configuration
+                file name includes.
+            start_dir (str or pathlib.Path): The directory where
+                the search starts.
+        Returns:
+            pathlib.Path:
+                The path to configuration file. If not found, return None.
+        """
+        start_dir = pathlib.Path(start_dir).resolve()
+        visited = []
+        conf = None
+        for dirpath in [start_dir] + list(start_dir.parents):
+            key = (dirpath, lang)
+            if key in self._search_cache:
+                conf = self._search_cache[key]
+                break
+            visited.append(key)
+            conf = self._search_conf(dirpath, lang)
+            if conf is not None:
+                break
+        else:
+            redpen_home = pathlib.Path(os.getenv('REDPEN_HOME', '.'))
+            conf = self._search_conf(redpen_home / 'conf', lang)
+        for key in visited:
+            self._search_cache[key] = conf
+        return conf
+
+    def read(self, lang, start_dir='.'):
+        """Read the configuration file nearest to the directory.
+
+        Args:
+            lang (str): The languange of the configuration.
+            start_dir (str or pathlib.Path): The directory where
+                the search starts.
+        Returns:
+            str: The RedPen XML configuration. If not found, return None.
+        """
+        conf = self.find(lang, start_dir)
+        if conf is None:
+            logging.debug('Not found %s configuration file for %s',
+                          lang, start_dir)
+            return None
+        config = self._config_cache.get(conf)
+        if config is None:
+            logging.debug('Found configuration file: %s', conf)
+            config = self._config_cache[conf] = conf.read_text(
+                encoding='utf8')
+        return config
+
+
+def get_default_configfile(lang, start_dir='.'):
     """Get default RedPen XML configuration file.
 
-    Search current directory.
+    Search the start directory (default is current directory).
     If no configurations are found, search the parent directories
     until root directory.
     If no configurations are found, search $REDPEN_HOME/conf/.
 
     Args:
         lang: The languange which searched configuration file name includes.
+        start_dir: The directory where the search starts.
     Returns:
         pathlib.Path:
             The path to configuration file. If not found, return None.
     """
-    redpen_conf_lang_name = 'redpen-conf-' + lang + '.xml'
-    def search_conf(dirpath):
-        conf = dirpath / 'redpen-conf.xml'
-        if conf.is_file():
-            return conf
-        conf = dirpath / redpen_conf_lang_name
-        if conf.is_file():
-            return conf
-        return None
-
-    current = pathlib.Path('.')
-    conf = search_conf(current)
-    if conf is not None:
-        return conf
-    for dirpath in current.resolve().parents:
-        conf = search_conf(dirpath)
-        if conf is not None:
-            return conf
-    redpen_home = pathlib.Path(os.getenv('REDPEN_HOME', '.'))
-    return search_conf(redpen_home / 'conf')
+    return _ConfigFinder().find(lang, start_dir)
 
 
 def get_document_parser_from_filename(filename):
@@ -168,53 +405,323 @@ def get_document_parser_from_filename(filename):
     return None
 
 
+def detect_language(document, sample_size=_LANGUAGE_SAMPLE_SIZE):
+    """Detect language of the document locally.
+
+    The language is decided by a histogram of Unicode ranges over
+    a sample of the document.
+
+    Args:
+        document (str): Document to detect which language uses.
+        sample_size (int): The maximum number of characters to be sampled.
+    Returns:
+        str: 'ja' or 'en'. If the language is ambiguous, return None.
+    """
+    if len(document) > sample_size:
+        # Sample from the beginning, middle and end of the document
+        size = sample_size // 3
+        middle = (len(document) - size) // 2
+        document = (document[:size] + document[middle:middle + size]
+                    + document[-size:])
+    num_ja = num_kana = num_latin = 0
+    for char in document:
+        code = ord(char)
+        if code < 0x80:
+            if char.isalpha():
+                num_latin += 1
+            continue
+        if any(low <= code <= high for low, high in _JA_CHAR_RANGES):
+            num_ja += 1
+            if _KANA_CHAR_RANGE[0] <= code <= _KANA_CHAR_RANGE[1]:
+                num_kana += 1
+    num_letters = num_ja + num_latin
+    if num_letters == 0:
+        return None
+    ja_ratio = num_ja / num_letters
+    if num_kana > 0 and ja_ratio >= _JA_RATIO_THRESHOLD:
+        return 'ja'
+    if ja_ratio < _EN_RATIO_THRESHOLD:
+        return 'en'
+    return None
+
+
+_PLAIN_LINE_PATTERN = re.compile(
+    r'^(?:.*?:)?(?P<line>\d+)(?=: ValidationError)')
+_PLAIN2_LINE_PATTERN = re.compile(r'^\s*Line: (?P<line>\d+)')
+_PLAIN2_ERROR_PATTERN = re.compile(r'^\s+(?!(Line|Sentence):)(?=\w)',
+                                   flags=re.MULTILINE)
+
+
+class ValidationError:
+    """Error entry in a validation result.
+
+    Attributes:
+        line_num (int): The line number of the error. None if unknown.
+        count (int): The number of errors in the entry. json2 and plain2
+            formats group errors by sentence.
+        data: The entry in the result format (dict for json formats,
+            Element for xml, and str for plain formats).
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('line_num', 'count', 'data')
+
+    def __init__(self, line_num, count, data):
+        self.line_num = line_num
+        self.count = count
+        self.data = data
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _get_json_line_num(error):
+    line_num = error.get('lineNum')
+    if line_num is None:
+        position = error.get('position', error).get('start') or {}
+        line_num = position.get('lineNum', position.get('line'))
+    return _to_int(line_num)
+
+def _shift_json_lines(obj, delta):
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if key in ('lineNum', 'line') and isinstance(value, int):
+                obj[key] = value + delta
+            else:
+                _shift_json_lines(value, delta)
+    elif isinstance(obj, list):
+        for value in obj:
+            _shift_json_lines(value, delta)
+
+def _shift_text_lines(pattern, text, delta):
+    match = pattern.match(text)
+    if match is None:
+        return text
+    line_num = int(match.group('line')) + delta
+    return (text[:match.start('line')] + str(line_num)
+            + text[match.end('line'):])
+
+
+class ValidationResult:
+    """Validation result of a document parsed once into error entries.
+
+    Attributes:
+        output_format (str): The format of the validation result.
+        errors (list): The list of ValidationError.
+    """
+    __slots__ = ('output_format', 'errors', '_document')
+
+    def __init__(self, output_format, errors, document=None):
+        self.output_format = output_format
+        self.errors = errors
+        self._document = document
+
+    @classmethod
+    def parse(cls, result, output_format):
+        """Parse validation result text.
+
+        Args:
+            result (str): A validation result. JSON formats may be
+                wrapped by a list.
+            output_format (str): The format of the validation result.
+        Returns:
+            ValidationResult: The parsed result.
+        """
+        if output_format in ('json', 'json2'):
+            document = json.loads(result)
+            if isinstance(document, list):
+                document = document[0]
+            count = ((lambda error: len(error['errors']))
+                     if output_format == 'json2' else (lambda error: 1))
+            errors = [
+                ValidationError(_get_json_line_num(error), count(error), error)
+                for error in document['errors']]
+            # The key is kept, so that to_json keeps the order of keys
+            document['errors'] = None
+            return cls(output_format, errors, document)
+        if output_format == 'plain':
+            errors = []
+            for line in result.splitlines():
+                match = _PLAIN_LINE_PATTERN.match(line)
+                line_num = int(match.group('line')) if match else None
+                errors.append(ValidationError(line_num, 1, line))
+            return cls(output_format, errors)
+        if output_format == 'plain2':
+            blocks = [[]]
+            for line in result.splitlines(True):
+                if _PLAIN2_LINE_PATTERN.match(line):
+                    # Blank lines separating errors belong to the next error
+                    separator = []
+                    while blocks[-1] and not blocks[-1][-1].strip():
+                        separator.insert(0, blocks[-1].pop())
+                    blocks.append(separator)
+                blocks[-1].append(line)
+            errors = []
+            for block in map(''.join, blocks):
+                match = _PLAIN2_LINE_PATTERN.match(block)
+                line_num = int(match.group('line')) if match else None
+                count = sum(1 for _ in _PLAIN2_ERROR_PATTERN.finditer(block))
+                if block:
+                    errors.append(ValidationError(line_num, count, block))
+            return cls(output_format, errors)
+        if output_format == 'xml':
+            errors = [
+                ValidationError(_to_int(error.findtext('lineNum')), 1, error)
+                for error in ET.fromstring(result).iterfind('error')]
+            return cls(output_format, errors)
+        raise ValueError('Unknown format: %s' % output_format)
+
+    @classmethod
+    def join(cls, results):
+        """Join validation results of parts of a document.
+
+        Args:
+            results (list): ValidationResult with the same format.
+                Line numbers must be already shifted to the whole document.
+        Returns:
+            ValidationResult: The joined result.
+        """
+        # pylint: disable=protected-access
+        errors = [error for result in results for error in result.errors]
+        return cls(results[0].output_format, errors, results[0]._document)
+
+    @property
+    def num_errors(self):
+        """Get the number of errors"""
+        return sum(error.count for error in self.errors)
+
+    def filter(self, predicate):
+        """Make a result which has only errors satisfying the predicate.
+
+        Args:
+            predicate (callable): The function which takes ValidationError.
+        Returns:
+            ValidationResult: The filtered result sharing error entries.
+        """
+        return ValidationResult(
+            self.output_format,
+            [error for error in self.errors if predicate(error)],
+            self._document)
+
+    def split(self, line_nums):
+        """Split the result into results of line ranges.
+
+        Args:
+            line_nums (list): The sorted first line numbers of the ranges.
+                Errors before the first range or without line number
+                belong to the first range.
+        Returns:
+            list: ValidationResult of each range sharing error entries.
+        """
+        errors_list = [[] for _ in line_nums]
+        for error in self.errors:
+            index = 0
+            if error.line_num is not None:
+                index = max(bisect.bisect_right(line_nums, error.line_num) - 1,
+                            0)
+            errors_list[index].append(error)
+        return [ValidationResult(self.output_format, errors, self._document)
+                for errors in errors_list]
+
+    def shift_lines(self, delta):
+        """Add delta to the line numbers of all errors in place.
+
+        Args:
+            delta (int): The number of lines to be added.
+        """
+        for error in self.errors:
+            if error.line_num is None:
+                continue
+            error.line_num += delta
+            if self.output_format in ('json', 'json2'):
+                _shift_json_lines(error.data, delta)
+            elif self.output_format == 'xml':
+                for elem in error.data.iter('lineNum'):
+                    elem.text = str(int(elem.text) + delta)
+            elif self.output_format == 'plain':
+                error.data = _shift_text_lines(
+                    _PLAIN_LINE_PATTERN, error.data, delta)
+            elif self.output_format == 'plain2':
+                error.data = _shift_text_lines(
+                    _PLAIN2_LINE_PATTERN, error.data, delta)
+
+    def to_json(self):
+        """Get the result as a JSON object of json formats.
+
+        Keys are in the order of the server reply.
+        """
+        document = dict(self._document or {})
+        document['errors'] = [error.data for error in self.errors]
+        return document
+
+    def __str__(self):
+        if self.output_format in ('json', 'json2'):
+            return json.dumps(self.to_json(), ensure_ascii=False)
+        if self.output_format == 'plain':
+            return '\n'.join(error.data for error in self.errors)
+        if self.output_format == 'plain2':
+            return ''.join(error.data for error in self.errors)
+        root = ET.Element('validation-result')
+        for error in self.errors:
+            root.append(error.data)
+        return ET.tostring(root, encoding='utf8').decode('utf8')
+
+
 def get_number_of_errors(result, output_format):
     """Get the number of errors in validation result.
 
     Args:
-        result (str): A validation result.
+        result (str or ValidationResult): A validation result.
         output_format (str): The format of the validation result.
     Returns:
         int: The number of errors in the validation result.
     """
-    if output_format == 'json':
-        result = json.loads(result)
-        return len(result[0]['errors'])
-    if output_format == 'json2':
-        result = json.loads(result)
-        return sum((len(error['errors']) for error in result[0]['errors']))
-    if output_format == 'plain':
-        return len(result.splitlines())
-    if output_format == 'plain2':
-        errors = re.finditer(r'^\s+(?!(Line|Sentence):)(?=\w)',
-                             result, flags=re.MULTILINE)
-        return sum((1 for _ in errors))
-    if output_format == 'xml':
-        root = ET.fromstring(result)
-        return len(root.findall('error'))
-    return 0 # Unknown format
-
-
-def get_version(base_url, timeout=None, user_agent=None, ssl_context=None):
+    if output_format not in _FORMAT_LIST:
+        return 0 # Unknown format
+    if not isinstance(result, ValidationResult):
+        result = ValidationResult.parse(result, output_format)
+    return result.num_errors
+
+
+def get_version(base_url, timeout=None, user_agent=None, ssl_context=None,
+                limiter=None, hedger=None):
     """Get RedPen version.
 
     Args:
         base_url (str): URL of RedPen server.
         timeout (int): The server communication timeout in seconds.
         ssl_context (ssl.SSLContext): SSL Context for server communication.
+        limiter (sabacan.limiter.AdaptiveLimiter): Concurrency limiter.
+        hedger (sabacan.hedging.Hedger): Request hedger.
     Returns:
         str: RedPen version.
     """
+    # pylint: disable=too-many-arguments
     url = base_url + '/rest/config/redpens'
     headers = sabacan.utils.make_headers(user_agent)
     request = urllib.request.Request(url, headers=headers)
-    with urllib.request.urlopen(
-            request, timeout=timeout, context=ssl_context) as response:
-        result = json.loads(response.read().decode('utf8'))
-        return result['version']
+    reply = sabacan.utils.urlread(
+        request, timeout=timeout, ssl_context=ssl_context,
+        limiter=limiter, hedger=hedger)
+    result = json.loads(reply.decode('utf8'))
+    return result['version']
 
 
-def get_language(base_url, document, timeout=None, ssl_context=None):
+def _make_post_request(url, fields, user_agent, encoder, cached_names=()):
+    headers = sabacan.utils.make_headers(user_agent)
+    if encoder is None:
+        data = urllib.parse.urlencode(
+            {name: value for name, value in fields.items()
+             if value is not None}).encode('utf8')
+    else:
+        data, content_headers = encoder.encode(fields, cached_names)
+        headers.update(content_headers)
+    return urllib.request.Request(url, data, headers)
+
+def get_language(base_url, document, timeout=None, user_agent=None,
+                 ssl_context=None, limiter=None, hedger=None, encoder=None):
     """Get language of the document.
 
     Args:
@@ -222,22 +729,27 @@ def get_language(base_url, document, timeout=None, ssl_context=None):
         document (str): Document to get which language uses.
         timeout (int): The server communication timeout in seconds.
         ssl_context (ssl.SSLContext): SSL Context for server communication.
+        limiter (sabacan.limiter.AdaptiveLimiter): Concurrency limiter.
+        hedger (sabacan.hedging.Hedger): Request hedger.
+        encoder (sabacan.formdata.FormEncoder): Encoder of request body.
+            If None, the body is URL encoded.
     Returns:
         str: The language of the document.
     """
+    # pylint: disable=too-many-arguments
     url = base_url + '/rest/document/language'
-    data = {'document': document}
-    data = urllib.parse.urlencode(data).encode('utf8')
-    headers = sabacan.utils.make_headers(user_agent)
-    request = urllib.request.Request(url, data, headers)
-    with urllib.request.urlopen(
-            request, timeout=timeout, context=ssl_context) as response:
-        result = json.loads(response.read().decode('utf8'))
-        return result['key']
+    request = _make_post_request(
+        url, {'document': document}, user_agent, encoder)
+    reply = sabacan.utils.urlread(
+        request, timeout=timeout, ssl_context=ssl_context,
+        limiter=limiter, hedger=hedger)
+    result = json.loads(reply.decode('utf8'))
+    return result['key']
 
 
 def validate(base_url, document, document_parser, lang, output_format,
-             config=None, timeout=None, user_agent=None, ssl_context=None):
+             config=None, timeout=None, user_agent=None, ssl_context=None,
+             limiter=None, hedger=None, structured=False, encoder=None):
     """Validate document.
 
     Args:
@@ -249,8 +761,14 @@ def validate(base_url, document, document_parser, lang, output_format,
         config (str): The RedPen XML configuration.
         timeout (int): The server communication timeout in seconds.
         ssl_context (ssl.SSLContext): SSL Context for server communication.
+        limiter (sabacan.limiter.AdaptiveLimiter): Concurrency limiter.
+        hedger (sabacan.hedging.Hedger): Request hedger.
+        structured (bool): Whether or not to return the parsed result.
+        encoder (sabacan.formdata.FormEncoder): Encoder of request body.
+            If None, the body is URL encoded.
     Returns:
-        str: The validation result with the specified format.
+        str or ValidationResult: The validation result with
+            the specified format.
     """
     # pylint: disable=too-many-arguments
     data = {
@@ -258,20 +776,60 @@ def validate(base_url, document, document_parser, lang, output_format,
         'documentParser': document_parser,
         'lang': lang,
         'format': output_format,
+        'config': config,
     }
-    if config is not None:
-        data['config'] = config
 
     url = base_url + '/rest/document/validate'
-    data = urllib.parse.urlencode(data).encode('utf8')
-    headers = sabacan.utils.make_headers(user_agent)
-    request = urllib.request.Request(url, data, headers)
-    with urllib.request.urlopen(
-            request, timeout=timeout, context=ssl_context) as response:
-        result = response.read().decode('utf8')
-        if output_format.startswith('json'):
-            return '[%s]' % result
-        return result
+    # The configuration is the same in most requests
+    request = _make_post_request(
+        url, data, user_agent, encoder, cached_names=('config',))
+    result = sabacan.utils.urlread(
+        request, timeout=timeout, ssl_context=ssl_context,
+        limiter=limiter, hedger=hedger).decode('utf8')
+    if structured:
+        return ValidationResult.parse(result, output_format)
+    if output_format.startswith('json'):
+        return '[%s]' % result
+    return result
+
+
+def validate_batch(base_url, documents, document_parser, lang,
+                   output_format, config=None, **options):
+    """Validate documents by one request.
+
+    Documents are joined with blank lines, so that they are parsed as
+    separate paragraphs, and errors are split back to each document.
+    Validators of document scope (e.g. ParagraphNumber) see all documents
+    as a document.
+
+    Args:
+        base_url (str): URL of RedPen server.
+        documents (list): Documents (str) to be validated.
+        document_parser (str): Document format in _BATCH_PARSERS.
+        lang (str): The language of documents.
+        output_format (str): The format of the validation result.
+        config (str): The RedPen XML configuration.
+        options: Other keyword arguments of `validate`.
+    Returns:
+        list: ValidationResult of each document.
+    """
+    # pylint: disable=too-many-arguments
+    texts = []
+    line_nums = []
+    line_num = 1
+    for document in documents:
+        if not document.endswith('\n'):
+            document += '\n'
+        texts.append(document)
+        line_nums.append(line_num)
+        line_num += document.count('\n') + 1 # followed by a blank line
+    result = validate(base_url, '\n'.join(texts), document_parser, lang,
+                      output_format, config=config, structured=True,
+                      **options)
+    results = result.split(line_nums)
+    for first_line_num, part in zip(line_nums, results):
+        part.shift_lines(1 - first_line_num)
+    return results
 
 
 def _exit_by_error(msg, *args, **kwargs):
@@ -294,6 +852,24 @@ def _get_lang_from_config(config):
     lang = root.attrib.get('lang', 'en')
     return lang
 
+def _get_document_language(base_url, options, contents):
+    key = hashlib.sha1(contents.encode('utf8')).hexdigest()
+    with _LANGUAGE_CACHE_LOCK:
+        lang = _LANGUAGE_CACHE.get(key)
+        if lang is not None:
+            _LANGUAGE_CACHE.move_to_end(key)
+            return lang
+    lang = detect_language(contents)
+    if lang is None:
+        logging.debug('Getting language from RedPen server...')
+        lang = get_language(base_url, contents, **options)
+    # Bounded for long running processes such as the daemon
+    with _LANGUAGE_CACHE_LOCK:
+        _LANGUAGE_CACHE[key] = lang
+        if len(_LANGUAGE_CACHE) > _LANGUAGE_CACHE_SIZE:
+            _LANGUAGE_CACHE.popitem(last=False)
+    return lang
+
 def _get_document_parser(args, document):
     if args.document_parser is not None:
         return args.document_parser
@@ -303,33 +879,35 @@ def _get_document_parser(args, document):
             return parser
     return 'plain'
 
-def _get_default_config(lang, config_cache):
-    if lang in config_cache:
-        return config_cache[lang]
-    logging.debug('Getting %s configuration file...', lang)
-    config_file = get_default_configfile(lang)
-    if config_file is None:
-        logging.debug('Not found %s configuration file...', lang)
-        config = None
-    else:
-        logging.debug('Found configuration file: %s', config_file)
-        config = config_file.read_text(encoding='utf8')
-    config_cache[lang] = config
-    return config
-
-
 class _Document:
-    def __init__(self, document):
+    def __init__(self, document, name=None):
         self._is_file = isinstance(document, pathlib.Path)
         self._document = document
+        self._name = name
 
     @property
     def filename(self):
         """Get filename"""
+        if self._name is not None:
+            return self._name
         if self._is_file:
             return self._document.name
         return None
 
+    @property
+    def path(self):
+        """Get path of the document file"""
+        if self._is_file:
+            return self._document
+        return None
+
+    @property
+    def directory(self):
+        """Get directory where the document is placed"""
+        if self._is_file:
+            return self._document.parent
+        return pathlib.Path('.')
+
     @property
     def document(self):
         """Get document"""
@@ -337,66 +915,166 @@ class _Document:
             return self._document.read_text(encoding='utf8')
         return self._document
 
-def _get_documents(args):
+_GLOB_MAGIC_PATTERN = re.compile(r'[*?[]')
+
+def _is_excluded(path, excludes):
+    name = os.path.basename(path)
+    return any(fnmatch.fnmatch(path, pattern) or fnmatch.fnmatch(name, pattern)
+               for pattern in excludes)
+
+def _iter_directory(dirpath, excludes):
+    # Entries are sorted per directory, so that the walk stays lazy
+    for entry in sorted(os.scandir(dirpath), key=lambda entry: entry.name):
+        if _is_excluded(entry.path, excludes):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            if not entry.name.startswith('.'):
+                yield from _iter_directory(entry.path, excludes)
+        elif (entry.is_file()
+              and get_document_parser_from_filename(entry.name) is not None):
+            yield pathlib.Path(entry.path)
+
+def _iter_input_files(input_file, excludes):
+    if os.path.isfile(input_file):
+        yield pathlib.Path(input_file)
+        return
+    if os.path.isdir(input_file):
+        yield from _iter_directory(input_file, excludes)
+        return
+    if _GLOB_MAGIC_PATTERN.search(input_file) is None:
+        _exit_by_error('%s is not regular file or directory', input_file)
+    matched = False
+    for path in glob.iglob(input_file, recursive=True):
+        matched = True
+        if _is_excluded(path, excludes):
+            continue
+        if os.path.isdir(path):
+            yield from _iter_directory(path, excludes)
+        elif get_document_parser_from_filename(path) is not None:
+            yield pathlib.Path(path)
+    if not matched:
+        _exit_by_error('No input matches %s', input_file)
+
+def _get_documents(args, changes=None):
+    """Iterate input documents.
+
+    Directories and glob patterns are expanded lazily, so that documents
+    are validated while the walk is in progress.
+    """
     logging.debug('Getting documents...')
     if args.document is not None:
-        return [_Document(args.document)]
+        yield _Document(args.document)
+        return
+    if changes is not None and not args.input_files:
+        for path in changes.files:
+            if get_document_parser_from_filename(path.name) is not None:
+                yield _Document(path, os.path.relpath(str(path)))
+        return
     if not args.input_files:
         _exit_by_error('Input is not given')
-    docs = []
     for input_file in args.input_files:
-        path = pathlib.Path(input_file)
-        if not path.is_file():
-            _exit_by_error('Input is not regular file')
-        docs.append(_Document(path))
-    return docs
+        for path in _iter_input_files(input_file, args.excludes):
+            if changes is not None and path not in changes:
+                logging.debug('%s is not changed', path)
+                continue
+            # Found documents are named by the path to be distinguished
+            name = None if os.path.isfile(input_file) else str(path)
+            yield _Document(path, name)
+
+def _filter_changed_lines(result, ranges):
+    if ranges is None:
+        return result
+    return result.filter(
+        lambda error: error.line_num is None or any(
+            first <= error.line_num <= last for first, last in ranges))
 
 class _PlainMerger:
-    def __init__(self):
+    def __init__(self, stream=None):
+        self._stream = stream
         self._result = []
 
     def __call__(self, name, result):
-        lines = result.splitlines()
+        lines = [error.data for error in result.errors]
         if name is not None:
-            self._result.extend(name + ':' + line for line in lines)
-        else:
+            lines = [name + ':' + line for line in lines]
+        if self._stream is None:
             self._result.extend(lines)
+            return
+        for line in lines:
+            self._stream.write(line + '\n')
+        self._stream.flush()
+
+    def close(self):
+        """Finish streaming output"""
 
     def __str__(self):
         return '\n'.join(self._result)
 
 class _Plain2Merger:
-    def __init__(self):
-        self._result = ''
+    def __init__(self, stream=None):
+        self._stream = stream
+        self._result = []
 
     def __call__(self, name, result):
+        text = str(result)
         if name is not None:
-            self._result += 'Document: ' + name + '\n'
-        self._result += result
+            text = 'Document: ' + name + '\n' + text
+        if self._stream is None:
+            self._result.append(text)
+            return
+        self._stream.write(text)
+        self._stream.flush()
+
+    def close(self):
+        """Finish streaming output"""
+        self._stream.write('\n')
+        self._stream.flush()
 
     def __str__(self):
-        return self._result
+        return ''.join(self._result)
 
 class _JSONMerger:
-    def __init__(self):
+    def __init__(self, stream=None):
+        self._stream = stream
         self._result = []
 
     def __call__(self, name, result):
-        json_result = json.loads(result)
+        json_result = result.to_json()
         if name is not None:
-            json_result[0]['document'] = name
-        self._result.append(json_result[0])
+            json_result['document'] = name
+        if self._stream is None:
+            self._result.append(json_result)
+            return
+        # Each document is written as a line of NDJSON
+        self._stream.write(json.dumps(json_result, ensure_ascii=False) + '\n')
+        self._stream.flush()
+
+    def close(self):
+        """Finish streaming output"""
 
     def __str__(self):
         return json.dumps(self._result, ensure_ascii=False)
 
 class _XMLMerger:
-    def __init__(self):
+    def __init__(self, stream=None):
+        self._stream = stream
         self._result = ET.Element('validation-result')
+        if stream is not None:
+            self._write("<?xml version='1.0' encoding='UTF-8'?>\n"
+                        '<validation-result>')
+
+    def _write(self, text):
+        # Encoded in UTF-8 as declared, whatever the stream encoding is
+        buffer = getattr(self._stream, 'buffer', None)
+        if buffer is None:
+            self._stream.write(text)
+            return
+        self._stream.flush()
+        buffer.write(text.encode('utf-8'))
 
     def __call__(self, name, result):
-        root = ET.fromstring(result)
-        for error in root.iterfind('error'):
+        for error in result.errors:
+            error = error.data
             if name is not None:
                 file_elem = ET.Element('file')
                 file_elem.text = name
@@ -405,25 +1083,656 @@ class _XMLMerger:
                     if elem.tag == 'lineNum':
                         break
                 error.insert(idx, file_elem)
-            self._result.append(error)
+            if self._stream is None:
+                self._result.append(error)
+            else:
+                self._write(ET.tostring(error, encoding='unicode'))
+        if self._stream is not None:
+            self._stream.flush()
+
+    def close(self):
+        """Finish streaming output"""
+        self._write('</validation-result>\n')
+        self._stream.flush()
 
     def __str__(self):
         return ET.tostring(self._result, encoding='utf8').decode('utf8')
 
+_MERGER_MAP = {
+    'plain': _PlainMerger,
+    'plain2': _Plain2Merger,
+    'json': _JSONMerger,
+    'json2': _JSONMerger,
+    'xml': _XMLMerger,
+}
+
 def _merge_result(results, output_format):
-    merger_map = {
-        'plain': _PlainMerger,
-        'plain2': _Plain2Merger,
-        'json': _JSONMerger,
-        'json2': _JSONMerger,
-        'xml': _XMLMerger,
-    }
-    merger = merger_map[output_format]()
+    merger = _MERGER_MAP[output_format]()
     for name, result in results:
+        if not isinstance(result, ValidationResult):
+            result = ValidationResult.parse(result, output_format)
         merger(name, result)
     return str(merger)
 
 
+def _has_only_validators(config, validator_names):
+    """Check whether all validators in configuration are in validator_names.
+    """
+    try:
+        root = ET.fromstring(config.encode('utf8'))
+    except ET.ParseError:
+        return False
+    return all(validator.get('name') in validator_names
+               for validators in root.iter('validators')
+               for validator in validators
+               if isinstance(validator.tag, str)) # not comment
+
+def _split_config(config, validator_names):
+    """Split configuration into validators of paragraphs and of documents.
+
+    Returns:
+        (str, str): The configurations without and only with the validators
+            in validator_names. If config has no such validators,
+            the latter is None.
+    """
+    if config is None:
+        return (config, None)
+    roots = [ET.fromstring(config.encode('utf8')) for _ in range(2)]
+    num_document_validators = 0
+    for is_document, root in enumerate(roots):
+        for validators in root.iter('validators'):
+            for validator in list(validators):
+                if not isinstance(validator.tag, str):
+                    continue # comment
+                in_document = validator.get('name') in validator_names
+                num_document_validators += in_document
+                if in_document != is_document:
+                    validators.remove(validator)
+    if num_document_validators == 0:
+        return (config, None)
+    return tuple(ET.tostring(root, encoding='unicode') for root in roots)
+
+def _group_units(units, keys, chunk_size):
+    """Group consecutive units by chunk_size characters"""
+    groups = []
+    size = 0
+    for index, unit in enumerate(units):
+        if keys[index] is None:
+            continue
+        if (groups and groups[-1][-1] == index - 1
+                and (chunk_size is None
+                     or size + len(unit.text) <= chunk_size)):
+            groups[-1].append(index)
+            size += len(unit.text)
+        else:
+            groups.append([index])
+            size = len(unit.text)
+    return groups
+
+def _validate_incrementally(validate_text, contents, document_parser,
+                            output_format, cache, key_parts, chunk_size, jobs):
+    """Validate the document reusing cached results of unchanged units.
+
+    The document is split into paragraphs and sections. Results are cached
+    per unit with line numbers relative to the unit, and shifted to
+    the line offset of the unit in the current document.
+    Consecutive changed units are validated together.
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    units = sabacan.chunking.split_units(contents, document_parser)
+    results = [None] * len(units)
+    keys = [None] * len(units)
+    for index, unit in enumerate(units):
+        key = sabacan.cache.make_key(*(key_parts + (unit.text,)))
+        cached = cache.get(key)
+        if cached is None:
+            keys[index] = key
+            continue
+        results[index] = ValidationResult.parse(cached, output_format)
+        results[index].shift_lines(unit.line_offset)
+
+    def validate_group(group):
+        line_offset = units[group[0]].line_offset
+        result = validate_text(''.join(units[index].text for index in group))
+        parts = result.split(
+            [units[index].line_offset - line_offset + 1 for index in group])
+        for index, part in zip(group, parts):
+            unit = units[index]
+            part.shift_lines(line_offset - unit.line_offset)
+            cache.put(keys[index], str(part))
+            part.shift_lines(unit.line_offset)
+        return list(zip(group, parts))
+
+    groups = _group_units(units, keys, chunk_size)
+    logging.debug('Validating %d of %d units...',
+                  sum(len(group) for group in groups), len(units))
+    for parts in sabacan.utils.parallel_map(validate_group, groups, jobs):
+        for index, part in parts:
+            results[index] = part
+    return ValidationResult.join(results)
+
+def _validate_with_cache(validate_text, args, contents, document_parser,
+                         lang, config):
+    # pylint: disable=too-many-arguments
+    cache = sabacan.cache.ResultCache(args.cache)
+    config, document_config = _split_config(config, args.document_validators)
+    key_parts = (args.format, document_parser, lang,
+                 sabacan.cache.make_key(config))
+    result = _validate_incrementally(
+        lambda text: validate_text(text, config),
+        contents, document_parser, args.format,
+        cache, key_parts, args.chunk_size, args.jobs)
+    if document_config is None:
+        return result
+
+    # Validators of document scope can not be applied to each unit
+    logging.debug('Validating whole document by %s...',
+                  ', '.join(args.document_validators))
+    key = sabacan.cache.make_key(
+        args.format, document_parser, lang,
+        sabacan.cache.make_key(document_config), 'document', contents)
+    cached = cache.get(key)
+    if cached is None:
+        document_result = validate_text(contents, document_config)
+        cache.put(key, str(document_result))
+    else:
+        document_result = ValidationResult.parse(cached, args.format)
+    result = ValidationResult.join([result, document_result])
+    result.errors.sort(key=lambda error: error.line_num or 0)
+    return result
+
+class _Cancelled(Exception):
+    """Exception raised when validation is stopped."""
+
+
+def _resolve_document(base_url, options, args, doc,
+                      global_config, global_lang, config_finder):
+    """Read the document, and get its parser, language and configuration.
+
+    Returns:
+        (str, str, str, str): The document parser, the contents,
+            the language and the configuration.
+    """
+    # pylint: disable=too-many-arguments
+    logging.debug('Getting document parser...')
+    document_parser = _get_document_parser(args, doc)
+    contents = doc.document
+    if global_config is None:
+        if args.lang is None:
+            logging.debug('Getting language from input document...')
+            with sabacan.tracing.span('language', document=doc.filename):
+                lang = _get_document_language(base_url, options, contents)
+        else:
+            lang = args.lang
+        logging.debug('Getting %s configuration file...', lang)
+        with sabacan.tracing.span('config', document=doc.filename):
+            config = config_finder.read(lang, doc.directory)
+    else:
+        lang = global_lang
+        config = global_config
+    return (document_parser, contents, lang, config)
+
+def _validate_document(base_url, options, args, doc,
+                       global_config, global_lang, config_finder,
+                       changes=None, cancelled=None, resolved=None,
+                       request_slots=None):
+    # pylint: disable=too-many-arguments,too-many-locals
+    if request_slots is None:
+        request_slots = threading.BoundedSemaphore(max(args.jobs, 1))
+    if resolved is None:
+        resolved = _resolve_document(base_url, options, args, doc,
+                                     global_config, global_lang,
+                                     config_finder)
+    document_parser, contents, lang, config = resolved
+
+    logging.debug('Validating input document '
+                  '(document_parser=%s, lang=%s, format=%s)...',
+                  document_parser, lang, args.format)
+    def validate_text(text, config=config):
+        if cancelled is not None and cancelled.is_set():
+            raise _Cancelled()
+        # Chunks and units are validated in nested parallel_map, so that
+        # the shared slots bound the number of requests in flight
+        with request_slots, sabacan.tracing.span(
+                'validate', document=doc.filename, size=len(text)):
+            return validate(base_url, text, document_parser, lang,
+                            args.format, config=config, structured=True,
+                            **options)
+
+    def validate_chunk(chunk):
+        result = validate_text(chunk.text)
+        result.shift_lines(chunk.line_offset)
+        return result
+
+    try:
+        if args.cache is not None:
+            result = _validate_with_cache(
+                validate_text, args, contents, document_parser, lang, config)
+        elif args.chunk_size is not None:
+            chunks = sabacan.chunking.split_document(
+                contents, document_parser, args.chunk_size)
+            logging.debug('Validating %d chunks...', len(chunks))
+            result = ValidationResult.join(list(sabacan.utils.parallel_map(
+                validate_chunk, chunks, args.jobs)))
+        else:
+            result = validate_text(contents)
+    except urllib.error.HTTPError as error:
+        with error:
+            _exit_by_error('Failed to validate input document (%d %s): %s',
+                           error.code, error.reason, error.read())
+    if args.changed_lines and changes is not None and doc.path is not None:
+        result = _filter_changed_lines(
+            result, changes.get_changed_lines(doc.path))
+    return (doc.filename, result)
+
+
+class _Batcher:
+    """Packer of small documents sharing request parameters into batches.
+
+    Only documents whose configuration has validators of sentences
+    (_SENTENCE_VALIDATORS) are batched.
+
+    Args:
+        batch_size (int): The maximum payload bytes of a batch.
+    """
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self._batchable_configs = {}
+        self._batches = {}
+
+    @staticmethod
+    def get_size(document):
+        """Get the payload bytes of a document in a batch.
+
+        Args:
+            document (str): The document.
+        Returns:
+            int: The bytes including the line break which `validate_batch`
+                appends to the document without it.
+        """
+        return len(document.encode('utf8')) + (not document.endswith('\n'))
+
+    def get_key(self, document_parser, lang, config):
+        """Get the key of batch for documents.
+
+        Returns:
+            tuple: The key. If documents can not be batched, return None.
+        """
+        if document_parser not in _BATCH_PARSERS or config is None:
+            return None # the server default may have document validators
+        is_batchable = self._batchable_configs.get(config)
+        if is_batchable is None:
+            is_batchable = self._batchable_configs[config] = (
+                _has_only_validators(config, _SENTENCE_VALIDATORS))
+        if not is_batchable:
+            return None
+        return (document_parser, lang, config)
+
+    def add(self, key, item, size, serial=0):
+        """Add an item to the batch of the key.
+
+        Args:
+            key (tuple): The key of batch.
+            item: The item.
+            size (int): The payload bytes of the item.
+            serial (int or float): The number or time recorded when a new
+                batch is opened.
+        Returns:
+            list: The items of the full batch which the item can not be
+                added to. None if there is no such batch.
+        """
+        full_batch = None
+        batch = self._batches.get(key)
+        if batch is not None and batch[0] + size > self.batch_size:
+            full_batch = self._batches.pop(key)[1]
+            batch = None
+        if batch is None:
+            batch = self._batches[key] = [0, [], serial]
+        batch[0] += size + 1 # a blank line separates documents
+        batch[1].append(item)
+        return full_batch
+
+    def __len__(self):
+        return len(self._batches)
+
+    def flush(self, serial=None):
+        """Get and remove batches.
+
+        Args:
+            serial (int or float): If given, only batches opened with
+                the serial or less are removed.
+        Returns:
+            list: The pairs of the key and the items of each batch.
+        """
+        keys = [key for key, batch in self._batches.items()
+                if serial is None or batch[2] <= serial]
+        return [(key, self._batches.pop(key)[1]) for key in keys]
+
+
+def _validate_in_batches(base_url, options, args, docs,
+                         global_config, global_lang, config_finder,
+                         changes=None, cancelled=None, request_slots=None):
+    """Validate documents packing small ones into batched requests.
+
+    Yields:
+        (str, ValidationResult): The name and the result of each document
+            in the order of docs.
+    """
+    # pylint: disable=too-many-arguments
+    if request_slots is None:
+        request_slots = threading.BoundedSemaphore(max(args.jobs, 1))
+
+    limiter = options['limiter']
+    window = 2 * max(args.jobs, limiter.max_limit if limiter else 1)
+
+    def resolve(doc):
+        return (doc, _resolve_document(base_url, options, args, doc,
+                                       global_config, global_lang,
+                                       config_finder))
+
+    def iter_tasks():
+        batcher = _Batcher(args.batch_size)
+        num_tasks = 0
+        # Documents are resolved by workers, since it may need requests
+        resolved_docs = sabacan.utils.parallel_map(
+            resolve, docs, args.jobs, limiter=limiter)
+        for index, (doc, resolved) in enumerate(resolved_docs):
+            document_parser, contents, lang, config = resolved
+            key = batcher.get_key(document_parser, lang, config)
+            size = batcher.get_size(contents)
+            tasks = []
+            if key is None or size >= batcher.batch_size:
+                tasks.append((None, [(index, doc, resolved)]))
+            else:
+                full_batch = batcher.add(
+                    key, (index, doc, contents), size, num_tasks)
+                if full_batch is not None:
+                    tasks.append((key, full_batch))
+            # Results are yielded in order of documents, so that a batch
+            # opened a window of tasks ago is sent not to hold later ones
+            tasks.extend(batcher.flush(num_tasks + len(tasks) - window))
+            num_tasks += len(tasks)
+            yield from tasks
+        yield from batcher.flush()
+
+    def run_task(task):
+        key, items = task
+        if key is None:
+            index, doc, resolved = items[0]
+            return [(index,) + _validate_document(
+                base_url, options, args, doc, global_config, global_lang,
+                config_finder, changes, cancelled, resolved, request_slots)]
+        if cancelled is not None and cancelled.is_set():
+            raise _Cancelled()
+        document_parser, lang, config = key
+        logging.debug('Validating %d documents in a batch '
+                      '(document_parser=%s, lang=%s, format=%s)...',
+                      len(items), document_parser, lang, args.format)
+        try:
+            with request_slots, sabacan.tracing.span(
+                    'validate', documents=len(items)):
+                results = validate_batch(
+                    base_url, [contents for _, _, contents in items],
+                    document_parser, lang, args.format, config=config,
+                    **options)
+        except urllib.error.HTTPError as error:
+            with error:
+                _exit_by_error('Failed to validate input documents '
+                               '(%d %s): %s',
+                               error.code, error.reason, error.read())
+        replies = []
+        for (index, doc, _), result in zip(items, results):
+            if (args.changed_lines and changes is not None
+                    and doc.path is not None):
+                result = _filter_changed_lines(
+                    result, changes.get_changed_lines(doc.path))
+            replies.append((index, doc.filename, result))
+        return replies
+
+    # Batches are completed out of order, so that results are reordered
+    pending = {}
+    next_index = 0
+    tasks = sabacan.utils.parallel_map(run_task, iter_tasks(), args.jobs,
+                                       window, limiter)
+    try:
+        for replies in tasks:
+            for index, name, result in replies:
+                pending[index] = (name, result)
+            while next_index in pending:
+                yield pending.pop(next_index)
+                next_index += 1
+    finally:
+        tasks.close()
+
+
+class _NDJSONValidator:
+    """Validator of documents given as NDJSON lines."""
+    def __init__(self, base_url, options, args, global_config, config_finder):
+        # pylint: disable=too-many-arguments
+        self._base_url = base_url
+        self._options = options
+        self._args = args
+        self._global_config = global_config
+        self._config_finder = config_finder
+        self._config_cache = collections.OrderedDict()
+        self._config_cache_lock = threading.Lock()
+
+    def _get_config(self, name):
+        # The name comes from the input, so that only XML files directly
+        # in the configuration directory can be read
+        if (not isinstance(name, str) or os.path.basename(name) != name
+                or (os.altsep is not None and os.altsep in name)
+                or name.startswith('.') or not name.endswith('.xml')):
+            raise ValueError('Invalid configuration name: %r' % (name,))
+        with self._config_cache_lock:
+            config = self._config_cache.get(name)
+            if config is not None:
+                self._config_cache.move_to_end(name)
+                return config
+        config = pathlib.Path(self._args.config_dir, name).read_text(
+            encoding='utf8')
+        with self._config_cache_lock:
+            self._config_cache[name] = config
+            if len(self._config_cache) > _CONFIG_CACHE_SIZE:
+                self._config_cache.popitem(last=False)
+        return config
+
+    def _resolve(self, request):
+        document = request['document']
+        document_parser = (request.get('parser') or self._args.document_parser
+                           or 'plain')
+        if request.get('config') is not None:
+            config = self._get_config(request['config'])
+        else:
+            config = self._global_config
+        lang = request.get('lang') or self._args.lang
+        if lang is None:
+            if config is not None:
+                lang = _get_lang_from_config(config)
+            else:
+                lang = _get_document_language(
+                    self._base_url, self._options, document)
+        if config is None:
+            config = self._config_finder.read(lang)
+        return (document, document_parser, lang, config)
+
+    def _make_reply(self, result):
+        if self._args.format.startswith('json'):
+            reply = result.to_json()
+        else:
+            reply = {'result': str(result)}
+        reply['numErrors'] = result.num_errors
+        return reply
+
+    @staticmethod
+    def _make_error_reply(error, line):
+        if isinstance(error, urllib.error.HTTPError):
+            with error:
+                return {'error': 'Failed to validate (%d %s): %s' % (
+                    error.code, error.reason,
+                    error.read().decode('utf8', 'replace'))}
+        logging.debug('Failed to validate %s', line, exc_info=True)
+        return {'error': '%s: %s' % (type(error).__name__, error)}
+
+    def _validate(self, request, resolved=None):
+        if resolved is None:
+            resolved = self._resolve(request)
+        document, document_parser, lang, config = resolved
+        result = validate(self._base_url, document, document_parser, lang,
+                          self._args.format, config=config, structured=True,
+                          **self._options)
+        return self._make_reply(result)
+
+    def prepare_batch(self, line, batcher):
+        """Resolve the document in the line, and get its batch.
+
+        Args:
+            line (str): JSON object which has id and document.
+            batcher (_Batcher): The batcher.
+        Returns:
+            (tuple, tuple, int): The key of batch, the item of the document
+                and the payload bytes. If the document can not be batched,
+                the key is None, and the item is the arguments to validate
+                it alone without resolving it again.
+        """
+        try:
+            request = json.loads(line)
+            resolved = self._resolve(request)
+        except Exception: # pylint: disable=broad-except
+            return (None, (line,), 0) # reported by validating it alone
+        document, document_parser, lang, config = resolved
+        key = batcher.get_key(document_parser, lang, config)
+        size = batcher.get_size(document)
+        if key is None or size >= batcher.batch_size:
+            return (None, (line, resolved), 0)
+        return (key, (request.get('id'), document), size)
+
+    def validate_batch(self, key, items):
+        """Validate the batched documents.
+
+        Args:
+            key (tuple): The key of batch.
+            items (list): The items of documents.
+        Returns:
+            list: The results with the ids.
+        """
+        document_parser, lang, config = key
+        try:
+            results = validate_batch(
+                self._base_url, [document for _, document in items],
+                document_parser, lang, self._args.format, config=config,
+                **self._options)
+            replies = [self._make_reply(result) for result in results]
+        except Exception as error: # pylint: disable=broad-except
+            replies = [self._make_error_reply(error, 'batch')] * len(items)
+        return [dict({'id': doc_id}, **reply)
+                for (doc_id, _), reply in zip(items, replies)]
+
+    def __call__(self, line, resolved=None):
+        """Validate the document in the line.
+
+        Args:
+            line (str): JSON object which has id and document.
+            resolved (tuple): The document, the parser, the language and
+                the configuration if they are already resolved.
+        Returns:
+            dict: The result with the id. If the validation fails,
+                it has error message instead of the result.
+        """
+        doc_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('Request must be JSON object')
+            doc_id = request.get('id')
+            reply = self._validate(request, resolved)
+        except Exception as error: # pylint: disable=broad-except
+            reply = self._make_error_reply(error, line)
+        return dict({'id': doc_id}, **reply)
+
+def _run_with_ndjson(validator, jobs, stdin, stdout, batcher=None,
+                     limiter=None):
+    # pylint: disable=too-many-arguments,too-many-locals
+    # Results are written as soon as validated, and not in input order,
+    # so that a slow document does not delay others in a long stream.
+    # Batched documents are written when the batch is full, when it is
+    # open for _BATCH_FLUSH_INTERVAL, or when input ends.
+    if limiter is not None:
+        # Requests are gated by the limiter instead of jobs
+        jobs = max(jobs, limiter.max_limit)
+    # Each line in progress, open batch and batch in progress has a slot
+    window = threading.BoundedSemaphore(max(jobs, 1) * 2)
+    output_lock = threading.Lock()
+    batch_lock = threading.Lock()
+    pending = set()
+    input_ended = threading.Event()
+
+    def write_replies(future):
+        replies = []
+        try:
+            replies = future.result()
+            if replies:
+                lines = ''.join(json.dumps(reply, ensure_ascii=False) + '\n'
+                                for reply in replies)
+                with output_lock:
+                    stdout.write(lines)
+                    stdout.flush()
+        finally:
+            with batch_lock:
+                pending.discard(future)
+            if replies is not None: # None if the slot is kept by a batch
+                window.release()
+
+    def submit(func, *args):
+        future = executor.submit(func, *args)
+        with batch_lock:
+            pending.add(future)
+        future.add_done_callback(write_replies)
+
+    def validate_line(line):
+        # Documents are resolved by workers, since it may need requests
+        key, item, size = validator.prepare_batch(line, batcher)
+        if key is None:
+            return [validator(*item)]
+        with batch_lock:
+            num_batches = len(batcher)
+            full_batch = batcher.add(key, item, size, time.monotonic())
+            is_opened = (full_batch is not None
+                         or len(batcher) > num_batches)
+        if full_batch is not None:
+            # The slot of the full batch is passed to its request
+            submit(validator.validate_batch, key, full_batch)
+        return None if is_opened else []
+
+    def flush_stale_batches():
+        while not input_ended.wait(_BATCH_FLUSH_INTERVAL):
+            with batch_lock:
+                batches = batcher.flush(
+                    time.monotonic() - _BATCH_FLUSH_INTERVAL)
+            for key, items in batches:
+                submit(validator.validate_batch, key, items)
+
+    lines = (line for line in stdin if line.strip())
+    with sabacan.utils.futures.ThreadPoolExecutor(max(jobs, 1)) as executor:
+        if batcher is None:
+            for line in lines:
+                window.acquire()
+                submit(lambda line: [validator(line)], line)
+            return
+        flusher = threading.Thread(target=flush_stale_batches, daemon=True)
+        flusher.start()
+        for line in lines:
+            window.acquire()
+            submit(validate_line, line)
+        input_ended.set()
+        flusher.join()
+        with batch_lock:
+            futures = list(pending)
+        # Lines in progress may still be added to batches
+        sabacan.utils.futures.wait(futures)
+        for key, items in batcher.flush():
+            submit(validator.validate_batch, key, items)
+
 def main(args):
     """Run action as redpen command.
 
@@ -438,43 +1747,72 @@ def main(args):
         print(get_version(base_url, **options))
         sys.exit(0)
 
+    encoder = sabacan.formdata.FormEncoder(
+        args.request_encoding, args.gzip_request)
+    options = dict(options, encoder=encoder)
     global_config = _get_config(args)
+    global_lang = None
     if global_config is not None:
-        lang = _get_lang_from_config(global_config)
-    config_cache = {}
-    results = []
-    num_error = 0
-    for doc in _get_documents(args):
-        logging.debug('Getting document parser...')
-        document_parser = _get_document_parser(args, doc)
-        contents = doc.document
-        if global_config is None:
-            if args.lang is None:
-                logging.debug('Getting language from input document...')
-                lang = get_language(base_url, contents, **options)
-            else:
-                lang = args.lang
-            config = _get_default_config(lang, config_cache)
-        else:
-            config = global_config
-
-        logging.debug('Validating input document '
-                      '(document_parser=%s, lang=%s, format=%s)...',
-                      document_parser, lang, args.format)
+        global_lang = _get_lang_from_config(global_config)
+    config_finder = _ConfigFinder()
+    if args.stdin_ndjson:
+        validator = _NDJSONValidator(
+            base_url, options, args, global_config, config_finder)
+        batcher = None
+        if args.batch_size is not None:
+            batcher = _Batcher(args.batch_size)
+        _run_with_ndjson(
+            validator, args.jobs,
+            io.TextIOWrapper(sys.stdin.buffer, encoding='utf8'), sys.stdout,
+            batcher, options['limiter'])
+        if args.upload_stats:
+            print(encoder.format_stats(), file=sys.stderr)
+        sys.exit(0)
+    changes = None
+    if args.changed_since is not None:
         try:
-            result = validate(base_url,
-                              contents, document_parser, lang, args.format,
-                              config=config, **options)
-        except urllib.error.HTTPError as error:
-            with error:
-                _exit_by_error('Failed to validate input document (%d %s): %s',
-                               error.code, error.reason, error.read())
-        results.append((doc.filename, result))
+            changes = sabacan.vcs.ChangeSet(args.changed_since)
+        except sabacan.vcs.GitError as error:
+            _exit_by_error('%s', error)
+    merger = _MERGER_MAP[args.format](sys.stdout if args.stream else None)
+    num_error = 0
+    cancelled = threading.Event()
+    # Requests for documents and for their chunks share --jobs slots.
+    # With the adaptive limiter, the limiter gates them instead.
+    request_slots = threading.BoundedSemaphore(
+        max(args.jobs, 1) if options['limiter'] is None
+        else options['limiter'].max_limit)
+    if args.batch_size is not None and args.cache is None:
+        results = _validate_in_batches(
+            base_url, options, args, _get_documents(args, changes),
+            global_config, global_lang, config_finder, changes, cancelled,
+            request_slots)
+    else:
+        results = sabacan.utils.parallel_map(
+            lambda doc: _validate_document(
+                base_url, options, args, doc, global_config, global_lang,
+                config_finder, changes, cancelled,
+                request_slots=request_slots),
+            _get_documents(args, changes), args.jobs,
+            limiter=options['limiter'])
+    for name, result in results:
+        with sabacan.tracing.span('merge', document=name):
+            merger(name, result)
 
         logging.debug('Calculating the number of errors...')
-        num_error += get_number_of_errors(result, args.format)
+        num_error += result.num_errors
+        if args.fail_fast and args.limit < num_error:
+            logging.debug('Stopping validation...')
+            cancelled.set()
+            results.close()
+            break
 
-    print(_merge_result(results, args.format))
+    if args.stream:
+        merger.close()
+    else:
+        print(merger)
+    if args.upload_stats:
+        print(encoder.format_stats(), file=sys.stderr)
     logging.debug('The number of errors is %d', num_error)
     if args.limit < num_error:
         _exit_by_error('The number of errors "%d" is larger'
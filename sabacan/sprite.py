@@ -0,0 +1,324 @@
+"""This module provides encoding of PNG images into PlantUML sprites.
+
+PNG images are decoded without external libraries, and converted to
+gray levels in the same way as PlantUML -encodesprite option.
+Interlaced images and all color types and bit depths are supported.
+Alpha channels are ignored like PlantUML.
+
+The following sprite levels are supported.
+
+:4, 8, 16:
+    4, 8 or 16 gray levels. 4 and 8 levels pack 3 and 2 rows into
+    a line.
+:4z, 8z, 16z:
+    Compressed variants of the above.
+"""
+import base64
+import struct
+import zlib
+
+LEVELS = ['4', '8', '16', '4z', '8z', '16z']
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_IHDR = struct.Struct('>IIBBBBB')
+
+# Number of samples per pixel for each color type
+_CHANNELS_TABLE = {
+    0: 1, # grayscale
+    2: 3, # truecolor
+    3: 1, # indexed-color
+    4: 2, # grayscale with alpha
+    6: 4, # truecolor with alpha
+}
+
+# Start and step of columns and rows for each Adam7 pass
+_ADAM7_PASSES = (
+    (0, 0, 8, 8), (4, 0, 8, 8), (0, 4, 4, 8), (2, 0, 4, 4),
+    (0, 2, 2, 4), (1, 0, 2, 2), (0, 1, 1, 2),
+)
+
+_SPRITE_CHARS = ('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+                 'abcdefghijklmnopqrstuvwxyz-_')
+_BASE64_TO_SPRITE_TABLE = str.maketrans(
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/',
+    _SPRITE_CHARS)
+# Gray value to 16 darkness levels (0 is white)
+_LEVEL16_TABLE = bytes((255 - gray) // 16 for gray in range(256))
+_HEX_TABLE = b'0123456789ABCDEF'.ljust(256, b'F')
+
+
+class PNGError(ValueError):
+    """Exception for invalid or unsupported PNG image."""
+
+
+class GrayImage:
+    """Image converted to gray.
+
+    Attributes:
+        width (int): The width.
+        height (int): The height.
+        pixels (bytearray): Gray values (0 is black) in row-major order.
+    """
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('width', 'height', 'pixels')
+
+    def __init__(self, width, height, pixels):
+        self.width = width
+        self.height = height
+        self.pixels = pixels
+
+
+def _iter_chunks(view):
+    if bytes(view[:8]) != _PNG_SIGNATURE:
+        raise PNGError('Not PNG image')
+    pos = 8
+    while pos + 12 <= len(view):
+        length, chunk_type = struct.unpack('>I4s', view[pos:pos + 8])
+        end = pos + 8 + length
+        if end + 4 > len(view):
+            break
+        crc, = struct.unpack('>I', view[end:end + 4])
+        if zlib.crc32(view[pos + 4:end]) != crc:
+            raise PNGError('Broken %s chunk' % chunk_type.decode('latin-1'))
+        yield (chunk_type, view[pos + 8:end])
+        if chunk_type == b'IEND':
+            return
+        pos = end + 4
+    raise PNGError('Image is truncated')
+
+
+def _paeth(left, up, upper_left):
+    estimate = left + up - upper_left
+    left_distance = abs(estimate - left)
+    up_distance = abs(estimate - up)
+    upper_left_distance = abs(estimate - upper_left)
+    if left_distance <= up_distance and left_distance <= upper_left_distance:
+        return left
+    if up_distance <= upper_left_distance:
+        return up
+    return upper_left
+
+
+def _unfilter(filter_type, row, prev, bpp):
+    # pylint: disable=too-many-branches
+    if filter_type == 0: # None
+        return
+    if filter_type == 1: # Sub
+        for i in range(bpp, len(row)):
+            row[i] = (row[i] + row[i - bpp]) & 0xff
+    elif filter_type == 2: # Up
+        for i, up in enumerate(prev):
+            row[i] = (row[i] + up) & 0xff
+    elif filter_type == 3: # Average
+        for i in range(bpp):
+            row[i] = (row[i] + (prev[i] >> 1)) & 0xff
+        for i in range(bpp, len(row)):
+            row[i] = (row[i] + ((row[i - bpp] + prev[i]) >> 1)) & 0xff
+    elif filter_type == 4: # Paeth
+        for i in range(bpp):
+            row[i] = (row[i] + prev[i]) & 0xff
+        for i in range(bpp, len(row)):
+            row[i] = (row[i] + _paeth(row[i - bpp], prev[i],
+                                      prev[i - bpp])) & 0xff
+    else:
+        raise PNGError('Unknown filter type: %d' % filter_type)
+
+
+def _unpack_samples(row, bit_depth, num_samples):
+    if bit_depth == 8:
+        return row
+    if bit_depth == 16:
+        return row[0::2] # the most significant bytes
+    mask = (1 << bit_depth) - 1
+    shifts = range(8 - bit_depth, -1, -bit_depth)
+    samples = bytearray(
+        (byte >> shift) & mask for byte in row for shift in shifts)
+    del samples[num_samples:]
+    return samples
+
+
+def _make_gray_converter(color_type, bit_depth, palette):
+    """Make a function which converts samples of a row to gray values."""
+    def rgb_to_gray(reds, greens, blues):
+        # Same as PlantUML ColorUtils.getGrayScaleColor
+        return bytearray(int(red * .3 + green * .59 + blue * .11)
+                         for red, green, blue in zip(reds, greens, blues))
+
+    if color_type == 3:
+        if palette is None:
+            raise PNGError('PLTE chunk is missing')
+        gray_palette = rgb_to_gray(palette[0::3], palette[1::3],
+                                   palette[2::3])
+        gray_palette.extend(bytes(256 - len(gray_palette)))
+        return lambda samples: samples.translate(gray_palette)
+    scale_table = None
+    if bit_depth < 8:
+        max_value = (1 << bit_depth) - 1
+        scale_table = bytes(value * 255 // max_value if value <= max_value
+                            else 0 for value in range(256))
+    if color_type in (0, 4):
+        channels = _CHANNELS_TABLE[color_type]
+        if scale_table is not None:
+            return lambda samples: samples.translate(scale_table)
+        return lambda samples: samples[0::channels]
+    channels = _CHANNELS_TABLE[color_type]
+    return lambda samples: rgb_to_gray(
+        samples[0::channels], samples[1::channels], samples[2::channels])
+
+
+def _read_pass(data, pos, width, height, bits_per_pixel, to_gray,
+               bit_depth, channels):
+    # pylint: disable=too-many-arguments
+    stride = (width * bits_per_pixel + 7) // 8
+    bpp = max(1, bits_per_pixel // 8)
+    prev = bytearray(stride)
+    rows = []
+    for _ in range(height):
+        if pos + 1 + stride > len(data):
+            raise PNGError('Image data is truncated')
+        row = bytearray(data[pos + 1:pos + 1 + stride])
+        _unfilter(data[pos], row, prev, bpp)
+        rows.append(to_gray(_unpack_samples(row, bit_depth, width * channels)))
+        prev = row
+        pos += 1 + stride
+    return (rows, pos)
+
+
+def read_png(data):
+    """Decode PNG image into gray values.
+
+    Args:
+        data (bytes-like): The PNG image.
+    Returns:
+        GrayImage: The decoded image.
+    Raises:
+        PNGError: If data is not valid PNG image.
+    """
+    # pylint: disable=too-many-locals
+    header = None
+    palette = None
+    decompressor = zlib.decompressobj()
+    decompressed = []
+    for chunk_type, chunk in _iter_chunks(memoryview(data)):
+        if chunk_type == b'IHDR':
+            if len(chunk) != _IHDR.size:
+                raise PNGError('Broken IHDR chunk')
+            header = _IHDR.unpack(chunk)
+        elif chunk_type == b'PLTE':
+            palette = bytes(chunk)
+        elif chunk_type == b'IDAT':
+            try:
+                decompressed.append(decompressor.decompress(chunk))
+            except zlib.error as error:
+                raise PNGError('Broken image data: %s' % error)
+    if header is None:
+        raise PNGError('IHDR chunk is missing')
+    width, height, bit_depth, color_type, _, _, interlace = header
+    channels = _CHANNELS_TABLE.get(color_type)
+    if (channels is None or bit_depth not in (1, 2, 4, 8, 16)
+            or (color_type == 3 and bit_depth == 16)
+            or (color_type in (2, 4, 6) and bit_depth < 8)):
+        raise PNGError('Unsupported color type %d with bit depth %d'
+                       % (color_type, bit_depth))
+    try:
+        decompressed.append(decompressor.flush())
+    except zlib.error as error:
+        raise PNGError('Broken image data: %s' % error)
+    raw = memoryview(b''.join(decompressed))
+    to_gray = _make_gray_converter(color_type, bit_depth, palette)
+    bits_per_pixel = bit_depth * channels
+
+    if not interlace:
+        rows, _ = _read_pass(raw, 0, width, height, bits_per_pixel, to_gray,
+                             bit_depth, channels)
+        return GrayImage(width, height, bytearray().join(rows))
+
+    pixels = bytearray(width * height)
+    pos = 0
+    for start_x, start_y, step_x, step_y in _ADAM7_PASSES:
+        pass_width = (width - start_x + step_x - 1) // step_x
+        pass_height = (height - start_y + step_y - 1) // step_y
+        if pass_width <= 0 or pass_height <= 0:
+            continue
+        rows, pos = _read_pass(raw, pos, pass_width, pass_height,
+                               bits_per_pixel, to_gray, bit_depth, channels)
+        for i, row in enumerate(rows):
+            offset = (start_y + i * step_y) * width + start_x
+            pixels[offset:offset + pass_width * step_x:step_x] = row
+    return GrayImage(width, height, pixels)
+
+
+def sprite_name(filename):
+    """Get a sprite name from the file name like PlantUML.
+
+    Args:
+        filename (str): The file name without directories.
+    Returns:
+        str: The leading letters, digits and underscores of filename.
+    """
+    for i, char in enumerate(filename):
+        if not (char.isalnum() or char == '_'):
+            filename = filename[:i]
+            break
+    return filename or 'test'
+
+
+def _encode_6bit_lines(levels, width, height, bits, num_rows):
+    padding = bytes(width * (-height % num_rows))
+    levels = memoryview(bytes(levels) + padding)
+    lines = []
+    for y in range(0, height, num_rows):
+        rows = [levels[(y + i) * width:(y + i + 1) * width]
+                for i in range(num_rows)]
+        lines.append(''.join(
+            _SPRITE_CHARS[sum(value << (bits * (num_rows - 1 - i))
+                              for i, value in enumerate(column))]
+            for column in zip(*rows)))
+    return lines
+
+
+def encode_sprite(image, name, level):
+    """Encode an image into PlantUML sprite.
+
+    Args:
+        image (GrayImage): The image.
+        name (str): The sprite name.
+        level (str): The gray level in LEVELS.
+    Returns:
+        str: The sprite definition.
+    """
+    if level not in LEVELS:
+        raise ValueError('Unknown sprite level: %s' % level)
+    is_compressed = level.endswith('z')
+    num_colors = int(level.rstrip('z'))
+    shift = {4: 2, 8: 1, 16: 0}[num_colors]
+    levels = image.pixels.translate(
+        bytes(value >> shift for value in _LEVEL16_TABLE))
+    width = image.width
+    if is_compressed:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+        compressed = compressor.compress(levels) + compressor.flush()
+        compressed += bytes(-len(compressed) % 3)
+        lines = [base64.b64encode(compressed).decode('ascii').translate(
+            _BASE64_TO_SPRITE_TABLE)]
+    elif num_colors == 16:
+        lines = [levels[y:y + width].translate(_HEX_TABLE).decode('ascii')
+                 for y in range(0, len(levels), width)]
+    else:
+        lines = _encode_6bit_lines(levels, width, image.height,
+                                   4 - shift, 3 if num_colors == 4 else 2)
+    return 'sprite $%s [%dx%d/%s] {\n%s\n}\n' % (
+        name, image.width, image.height, level, '\n'.join(lines))
+
+
+def encode_sprite_file(filepath, level):
+    """Encode PNG image file into PlantUML sprite named after the file.
+
+    Args:
+        filepath (pathlib.Path): The PNG image file.
+        level (str): The gray level in LEVELS.
+    Returns:
+        str: The sprite definition.
+    """
+    image = read_png(filepath.read_bytes())
+    return encode_sprite(image, sprite_name(filepath.name), level)
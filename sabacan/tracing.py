@@ -0,0 +1,143 @@
+"""This module provides tracing of processing phases.
+
+Spans are recorded only while tracing is started, and written in
+Chrome trace event format, which can be opened by Perfetto UI or
+chrome://tracing. While tracing is stopped, `span` returns a shared
+no-op context manager.
+"""
+import os
+import threading
+import time
+
+
+class _NullSpan:
+    # pylint: disable=too-few-public-methods
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('_tracer', '_name', '_args', '_start')
+
+    def __init__(self, tracer, name, args):
+        self._tracer = tracer
+        self._name = name
+        self._args = args
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._tracer.add(self._name, self._start, time.perf_counter(),
+                         self._args)
+        return False
+
+
+class Tracer:
+    """Recorder of spans."""
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._events = []
+        self._thread_names = {}
+
+    def span(self, name, **args):
+        """Make a context manager which records a span.
+
+        Args:
+            name (str): The name of span.
+            args: Additional information of span.
+        Returns:
+            The context manager.
+        """
+        return _Span(self, name, args)
+
+    def add(self, name, start, end, args):
+        """Record a span.
+
+        Args:
+            name (str): The name of span.
+            start (float): The start time by time.perf_counter.
+            end (float): The end time by time.perf_counter.
+            args (dict): Additional information of span.
+        """
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': 'sabacan',
+            'ph': 'X',
+            'ts': (start - self._origin) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': thread.ident,
+            'args': args,
+        }
+        with self._lock:
+            self._events.append(event)
+            self._thread_names[thread.ident] = thread.name
+
+    def to_json(self):
+        """Get trace events as a JSON object"""
+        with self._lock:
+            metadata = [
+                {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+                 'tid': tid, 'args': {'name': name}}
+                for tid, name in self._thread_names.items()]
+            return {'traceEvents': metadata + self._events,
+                    'displayTimeUnit': 'ms'}
+
+
+_TRACER = None
+
+
+def start():
+    """Start recording spans."""
+    global _TRACER # pylint: disable=global-statement
+    _TRACER = Tracer()
+
+
+def stop(path):
+    """Stop recording spans, and write them.
+
+    Args:
+        path (str): The output file of Chrome trace event JSON.
+    """
+    global _TRACER # pylint: disable=global-statement
+    tracer, _TRACER = _TRACER, None
+    if tracer is None:
+        return
+    import json # pylint: disable=import-outside-toplevel
+    with open(path, 'w', encoding='utf-8') as trace_file:
+        json.dump(tracer.to_json(), trace_file)
+
+
+def is_enabled():
+    """Check whether tracing is started.
+
+    Returns:
+        bool: True if spans are recorded.
+    """
+    return _TRACER is not None
+
+
+def span(name, **args):
+    """Make a context manager which records a span if tracing is started.
+
+    Args:
+        name (str): The name of span.
+        args: Additional information of span.
+    Returns:
+        The context manager.
+    """
+    tracer = _TRACER
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, **args)
@@ -1,9 +1,50 @@
 """This module provides utility function to sabacan.
 """
 import argparse
+import collections
+import importlib
 import logging
 import os
-import ssl
+import queue
+import socket
+import threading
+import time
+import urllib.error
+
+import sabacan.hedging
+import sabacan.limiter
+import sabacan.tracing
+
+
+class LazyModule:
+    """Proxy of module which is imported on the first attribute access.
+
+    Args:
+        *names (str): Candidates of the module name.
+            The first importable module is used.
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, *names):
+        self._names = names
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            for name in self._names[:-1]:
+                try:
+                    self._module = importlib.import_module(name)
+                    break
+                except ImportError:
+                    pass
+            else:
+                self._module = importlib.import_module(self._names[-1])
+        return getattr(self._module, attr)
+
+
+futures = LazyModule('concurrent.futures') # pylint: disable=invalid-name
+ssl = LazyModule('ssl') # pylint: disable=invalid-name
+_urlrequest = LazyModule('urllib.request') # pylint: disable=invalid-name
+_connection = LazyModule('sabacan.connection') # pylint: disable=invalid-name
 
 
 class SetEnvAction(argparse.Action): # pylint: disable=too-few-public-methods
@@ -31,7 +72,7 @@ class SetFlagEnvAction(argparse.Action):
 
 
 def get_connection_info(servername, default_url=None, default_timeout=None):
-    """Get URL, timeout, and SSL context.
+    """Get URL, timeout, SSL context, concurrency limiter and hedger.
 
     Args:
         servername (str): The name of application (e.g. plantuml)
@@ -41,13 +82,15 @@ def get_connection_info(servername, default_url=None, default_timeout=None):
             in environment variables.
     Returns:
         (str, dict): URL of server, and a dictionary including
-            timeout, user-agent and SSL context.
+            timeout, user-agent, SSL context, limiter and hedger.
     """
     url = get_server_url(servername, default_url)
     options = {
         'timeout': get_timeout(servername, default_timeout),
         'user_agent': get_user_agent(servername),
         'ssl_context': get_context(),
+        'limiter': get_limiter(servername),
+        'hedger': get_hedger(servername, url),
     }
     return (url, options)
 
@@ -113,6 +156,52 @@ def get_context():
         return ssl._create_unverified_context()
     return None
 
+def get_limiter(servername):
+    """Get adaptive concurrency limiter from environment variables.
+
+    Args:
+        servername (str): The name of application (e.g. plantuml)
+    Returns:
+        sabacan.limiter.AdaptiveLimiter: The limiter shared by
+            communication to the server. If adaptive concurrency is not
+            enabled, return None.
+    """
+    adaptive = os.getenv('_SABACAN_ADAPTIVE')
+    if adaptive is not None and adaptive != '0':
+        return sabacan.limiter.get_limiter(servername)
+    return None
+
+def get_hedger(servername, base_url):
+    """Get request hedger from environment variables.
+
+    Hedging is enabled by SABACAN_[<SERVER>_]HEDGE_PERCENTILE.
+    SABACAN_[<SERVER>_]HEDGE_URL is a comma separated list of backend URLs
+    for duplicate requests, and SABACAN_[<SERVER>_]HEDGE_BUDGET is
+    the maximum ratio of duplicate requests (default: 0.05).
+
+    Args:
+        servername (str): The name of application (e.g. plantuml)
+        base_url (str): URL of the primary server.
+    Returns:
+        sabacan.hedging.Hedger: The hedger shared by communication to
+            the server. If hedging is not enabled, return None.
+    """
+    def getenv(name, default=None):
+        value = os.getenv('SABACAN_%s_%s' % (servername.upper(), name))
+        if value is not None:
+            return value
+        return os.getenv('SABACAN_' + name, default)
+
+    try:
+        percentile = float(getenv('HEDGE_PERCENTILE'))
+        budget = float(getenv('HEDGE_BUDGET', '0.05'))
+    except (TypeError, ValueError):
+        return None
+    backend_urls = [url.strip() for url in getenv('HEDGE_URL', '').split(',')
+                    if url.strip()]
+    return sabacan.hedging.get_hedger(
+        base_url, backend_urls, percentile, budget)
+
 
 def make_headers(user_agent):
     """Make HTTP headers from arguments.
@@ -127,6 +216,202 @@ def make_headers(user_agent):
         headers['User-Agent'] = user_agent
     return headers
 
+def _is_timeout(error):
+    if isinstance(error, socket.timeout):
+        return True
+    if isinstance(error, urllib.error.HTTPError):
+        return False
+    return isinstance(getattr(error, 'reason', None), socket.timeout)
+
+_CONNECTION_POOL = None
+
+def enable_keepalive():
+    """Reuse HTTP connections in later requests of the process.
+
+    This is intended for long running processes, which send many requests
+    to the same server.
+    """
+    global _CONNECTION_POOL # pylint: disable=global-statement
+    if _CONNECTION_POOL is None:
+        _CONNECTION_POOL = _connection.ConnectionPool()
+
+def _open_read(request, timeout, ssl_context):
+    with sabacan.tracing.span('request', url=request.full_url,
+                              size=len(request.data or b'')):
+        if _CONNECTION_POOL is not None:
+            return _CONNECTION_POOL.read(request, timeout, ssl_context)
+        with _urlrequest.urlopen(
+                request, timeout=timeout, context=ssl_context) as response:
+            return response.read()
+
+def _urlread(request, timeout, ssl_context, limiter,
+             timeout_is_overload=True):
+    if limiter is None:
+        return _open_read(request, timeout, ssl_context)
+    size = len(request.full_url) + len(request.data or b'')
+    limiter.acquire()
+    try:
+        start = time.monotonic()
+        result = _open_read(request, timeout, ssl_context)
+        limiter.on_success(time.monotonic() - start, size)
+        return result
+    except urllib.error.HTTPError as error:
+        if error.code in sabacan.limiter.OVERLOAD_STATUS_CODES:
+            limiter.on_overload()
+        raise
+    except (socket.timeout, urllib.error.URLError) as error:
+        if timeout_is_overload and _is_timeout(error):
+            limiter.on_overload()
+        raise
+    finally:
+        limiter.release()
+
+def urlread(request, timeout=None, ssl_context=None, limiter=None,
+            hedger=None):
+    """Send HTTP request and read the response body.
+
+    If limiter is given, the number of concurrent requests is limited by it,
+    and the timeout is computed from the observed latency.
+    When the computed timeout expires, the request is sent again with
+    the given timeout.
+    If hedger is given, a duplicate request is sent when the request
+    is slow, and the reply which arrives first is used.
+
+    Args:
+        request (urllib.request.Request): The request.
+        timeout (int): The server communication timeout in seconds.
+        ssl_context (ssl.SSLContext): SSL Context for server communication.
+        limiter (sabacan.limiter.AdaptiveLimiter): Concurrency limiter.
+        hedger (sabacan.hedging.Hedger): Request hedger.
+    Returns:
+        bytes: The response body.
+    Raises:
+        urllib.error.HTTPError: If some server error occurs.
+        urllib.error.URLError: If some protocol error occurs.
+    """
+    if hedger is not None:
+        return hedger.send(
+            request,
+            lambda req: urlread(req, timeout, ssl_context, limiter))
+    if limiter is None:
+        return _urlread(request, timeout, ssl_context, None)
+    size = len(request.full_url) + len(request.data or b'')
+    adaptive_timeout = limiter.get_timeout(size, timeout)
+    try:
+        return _urlread(request, adaptive_timeout, ssl_context, limiter)
+    except (socket.timeout, urllib.error.URLError) as error:
+        if not _is_timeout(error) or adaptive_timeout == timeout:
+            raise
+        logging.debug('Retrying request to %s with timeout %s',
+                      request.full_url, timeout)
+        # The expired adaptive timeout has already decreased the limit
+        return _urlread(request, timeout, ssl_context, limiter,
+                        timeout_is_overload=False)
+
+
+class DaemonThreadPool:
+    """Thread pool whose workers do not block the interpreter exit.
+
+    Workers of concurrent.futures.ThreadPoolExecutor are joined at exit,
+    so that requests abandoned by --fail-fast would delay the exit until
+    they complete.
+
+    Args:
+        num_threads (int): The maximum number of worker threads.
+    """
+    def __init__(self, num_threads):
+        self._num_threads = num_threads
+        self._queue = queue.Queue()
+        self._threads = []
+
+    def submit(self, func, *args):
+        """Schedule the function.
+
+        Returns:
+            concurrent.futures.Future: The future of the result.
+        """
+        future = futures.Future()
+        self._queue.put((future, func, args))
+        if len(self._threads) < self._num_threads:
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return future
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            future, func, args = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = func(*args)
+            except BaseException as error: # pylint: disable=broad-except
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait=True):
+        """Stop workers after the scheduled functions.
+
+        Args:
+            wait (bool): Whether to wait for the workers to stop.
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+def parallel_map(func, iterable, jobs=1, window=None, limiter=None):
+    """Apply function to each item concurrently and yield results in order.
+
+    Items are taken from the iterable lazily, so that at most `window`
+    items are processed or waiting for being yielded at the same time.
+    When the generator is closed, items which are not started are
+    cancelled, and running items are abandoned in daemon threads,
+    so that they do not delay the exit of the interpreter.
+
+    Args:
+        func (callable): The function applied to each item.
+        iterable (iterable): The items.
+        jobs (int): The number of worker threads. If it is less than 2,
+            the items are processed in the current thread.
+        window (int): The maximum number of items in flight.
+            Defaults to twice the number of jobs.
+        limiter (sabacan.limiter.AdaptiveLimiter): Concurrency limiter
+            used by func. If it is given, the number of worker threads is
+            its maximum limit, so that the number of concurrent requests
+            follows the current limit instead of jobs.
+    Yields:
+        The results of func in the order of the items.
+    """
+    if limiter is not None:
+        jobs = max(jobs or 1, limiter.max_limit)
+    if jobs is None or jobs < 2:
+        for item in iterable:
+            yield func(item)
+        return
+    if window is None:
+        window = jobs * 2
+    executor = DaemonThreadPool(jobs)
+    pending = collections.deque()
+    try:
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        # If the caller stops the iteration, running items are abandoned
+        executor.shutdown(wait=not pending)
+
 
 class NotSupportedAction(argparse.Action):
     """Custom argparse.Action class for not supported options.
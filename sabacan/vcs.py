@@ -0,0 +1,111 @@
+"""This module provides functions to get changed files by git command.
+
+Changes are computed between the merge base of the revision and HEAD,
+and the working tree, so that uncommitted and untracked files are
+also included.
+"""
+import os
+import pathlib
+import re
+import subprocess
+
+_HUNK_PATTERN = re.compile(
+    r'^@@ -\d+(?:,\d+)? \+(?P<start>\d+)(?:,(?P<count>\d+))? @@')
+
+
+class GitError(RuntimeError):
+    """Error raised when git command fails."""
+
+
+def _run_git(args, cwd=None):
+    try:
+        process = subprocess.run(
+            ['git'] + list(args), cwd=cwd,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as error:
+        raise GitError('Failed to run git: %s' % error)
+    if process.returncode != 0:
+        raise GitError('git %s: %s' % (
+            args[0], process.stderr.decode('utf8', 'replace').strip()))
+    return process.stdout
+
+def _split_names(output):
+    return [os.fsdecode(name) for name in output.split(b'\0') if name]
+
+
+def parse_hunk_ranges(diff):
+    """Parse line ranges of new files from unified diff without context.
+
+    Args:
+        diff (str): The output of `git diff -U0`.
+    Returns:
+        list: The list of (first, last) line numbers of added or modified
+            lines. Hunks which only delete lines are ignored.
+    """
+    ranges = []
+    for line in diff.splitlines():
+        match = _HUNK_PATTERN.match(line)
+        if match is None:
+            continue
+        start = int(match.group('start'))
+        count = int(match.group('count') or 1)
+        if count > 0:
+            ranges.append((start, start + count - 1))
+    return ranges
+
+
+class ChangeSet:
+    """Files changed since the merge base of the revision.
+
+    Args:
+        revision (str): The revision (e.g. origin/master).
+        cwd (str or pathlib.Path): The directory in the repository.
+    Raises:
+        GitError: If git command fails.
+    """
+    def __init__(self, revision, cwd='.'):
+        self._toplevel = pathlib.Path(os.fsdecode(_run_git(
+            ['rev-parse', '--show-toplevel'], cwd=str(cwd)).strip()))
+        self._base = _run_git(['merge-base', revision, 'HEAD'],
+                              cwd=str(self._toplevel)).decode('ascii').strip()
+        changed = _split_names(self._git(
+            'diff', '--name-only', '-z', '--diff-filter=d', self._base))
+        untracked = _split_names(self._git(
+            'ls-files', '-z', '--others', '--exclude-standard', '--full-name'))
+        self._files = {self._toplevel / name: False for name in changed}
+        self._files.update((self._toplevel / name, True) for name in untracked)
+        self._ranges_cache = {}
+
+    def _git(self, *args):
+        return _run_git(args, cwd=str(self._toplevel))
+
+    @property
+    def files(self):
+        """Get the sorted list of changed files"""
+        return sorted(self._files)
+
+    def __contains__(self, path):
+        return pathlib.Path(path).resolve() in self._files
+
+    def get_changed_lines(self, path):
+        """Get the changed line ranges of the file.
+
+        Args:
+            path (str or pathlib.Path): The changed file.
+        Returns:
+            list: The list of (first, last) line numbers.
+                If all lines are new (e.g. untracked file), return None.
+        """
+        path = pathlib.Path(path).resolve()
+        if path not in self._files:
+            return []
+        if self._files[path]: # untracked
+            return None
+        ranges = self._ranges_cache.get(path)
+        if ranges is None:
+            diff = self._git('diff', '-U0', '--no-color', '--no-ext-diff',
+                             self._base, '--',
+                             str(path.relative_to(self._toplevel)))
+            ranges = self._ranges_cache[path] = parse_hunk_ranges(
+                diff.decode('utf8', 'replace'))
+        return ranges
@@ -18,7 +18,10 @@ setup(
     keywords=['plantuml', 'redpen'],
     packages=['sabacan'],
     entry_points={
-        'console_scripts': ['sabacan = sabacan:main'],
+        'console_scripts': [
+            'sabacan = sabacan:main',
+            'sabacan-client = sabacan.client:main',
+        ],
     },
     python_requires='>=3.5',
     classifiers=[